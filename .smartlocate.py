@@ -1,44 +1,80 @@
+from __future__ import annotations
+
 import sys
 import os
+import time
+from typing import Any
+
+# --timing is looked at before the arguments are parsed, so the imports below are timed as well
+startup_time: float = time.perf_counter()
+import_times: dict[str, float] = {}
+step_times: list[tuple[str, float]] = []
+
+if "--timing" in sys.argv[1:]:
+    import builtins
+
+    original_import = builtins.__import__
+    import_depth: int = 0
+
+    def timed_import(name: str, import_globals: Any = None, import_locals: Any = None, fromlist: Any = (), level: int = 0) -> Any:
+        # Only the outermost import of a module not loaded yet is timed, including everything it imports itself
+        global import_depth
+
+        if import_depth > 0 or level > 0 or name in sys.modules:
+            return original_import(name, import_globals, import_locals, fromlist, level)
+
+        import_depth += 1
+        start = time.perf_counter()
+
+        try:
+            return original_import(name, import_globals, import_locals, fromlist, level)
+        finally:
+            import_depth -= 1
+            import_times[name] = import_times.get(name, 0) + time.perf_counter() - start
+
+    builtins.__import__ = timed_import  # type: ignore[assignment]
+
+def add_step_time(step: str) -> None:
+    # Time since the previous step, shown with --timing
+    previous_end = startup_time + sum(seconds for _, seconds in step_times)
+    step_times.append((step, time.perf_counter() - previous_end))
 
 try:
     import warnings
     warnings.simplefilter(action='ignore', category=FutureWarning)
 
-    import numpy
     import subprocess
-    import requests
     import tempfile
     import re
     import uuid
     import argparse
     import sqlite3
     import random
-    from pprint import pprint
-    import time
-    from typing import Optional, Any, Generator, Union
+    import pickle
+    from typing import Optional, Generator, Union, TYPE_CHECKING
 
     from pathlib import Path
     from datetime import datetime
     import hashlib
-    from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn, TimeRemainingColumn
+    import importlib.util
+    import io
+    import json
+    import mmap
+    import multiprocessing
+    import threading
+    from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
     from rich.table import Table
     from rich.console import Console
-    from rich_argparse import RichHelpFormatter
-    from rich.highlighter import RegexHighlighter
-    from rich.theme import Theme
     import rich.errors
+    from rich.markup import escape
     from rich.panel import Panel
     from rich.text import Text
-    from rich.prompt import Prompt
-
-    import PIL
-    from sixel import converter
-    import cv2
-
-    from pathlib import Path
 
-    from pyzbar.pyzbar import decode
+    # numpy, cv2, PIL, sixel, pyzbar, requests and rich.progress are imported where they are
+    # needed, so a search doesn't have to load any of them
+    if TYPE_CHECKING:
+        import numpy
+        from rich.progress import Progress
 
     from typing import Callable, TypeVar
 
@@ -57,8 +93,12 @@ except ModuleNotFoundError as e:
     print(f"The following module could not be found: {e}")
     sys.exit(1)
 
+add_step_time("imports")
+
 @typechecked
 def dier(msg: Any) -> None:
+    from pprint import pprint
+
     pprint(msg)
     sys.exit(10)
 
@@ -81,14 +121,47 @@ original_pwd = os.getenv("ORIGINAL_PWD")
 DEFAULT_MIN_CONFIDENCE_FOR_SAVING: float = 0.1
 DEFAULT_DB_PATH: str = os.path.expanduser('~/.smartlocate_db')
 DEFAULT_ENCODINGS_FILE: str = os.path.expanduser("~/.smartlocate_face_encodings.pkl")
+DEFAULT_FACE_CROP_DIR: str = os.path.expanduser("~/.smartlocate_face_crops")
 DEFAULT_MODEL: str = "yolov5s.pt"
 DEFAULT_YOLO_THRESHOLD: float = 0.7
 DEFAULT_SIXEL_WIDTH: int = 400
 DEFAULT_MAX_SIZE: int = 5
+DEFAULT_YOLO_BATCH_SIZE: int = 1
+DEFAULT_BLIP_BATCH_SIZE: int = 1
+DEFAULT_JOBS: int = 1
+DEFAULT_COMMIT_EVERY: int = 1000
+DEFAULT_COMMIT_INTERVAL: float = 5.0
+DEFAULT_HASH_ALGORITHM: str = "md5"
+DEFAULT_HASH_THREADS: int = 0
+DEFAULT_SEARCH_LIMIT: int = 0
+HASH_BUFFER_SIZE: int = 1024 * 1024
+HASH_MMAP_MIN_SIZE: int = 16 * 1024 * 1024
 DEFAULT_BLIP_MODEL_NAME: str = "Salesforce/blip-image-captioning-large"
 DEFAULT_TOLERANCE_FACE_DETECTION: float = 0.6
+FACE_ENCODING_SIZE: int = 128
+DEFAULT_FACE_INDEX_MIN_SIZE: int = 10000
+IVF_KMEANS_ITERATIONS: int = 10
+IVF_NPROBE: int = 8
+FACE_CLUSTER_MIN_SAMPLES: int = 2
+FACE_CLUSTER_CHUNK_SIZE: int = 1024
+DEFAULT_FACE_MODEL: str = "hog"
+DEFAULT_FACE_UPSAMPLE: int = 1
+DEFAULT_FACE_DETECTION_MAX_SIZE: int = 0
+FACE_CROP_SIZE: int = 160
+FTS_SNIPPET_TOKENS: int = 24
+FTS_HIGHLIGHT_START: str = "\x02"
+FTS_HIGHLIGHT_END: str = "\x03"
+FACE_CROP_MARGIN: float = 0.25
 DEFAULT_DIR: str = str(Path.home())
 DEFAULT_LANG_OCR: list[str] = ['de', 'en']
+DEFAULT_SQLITE_PRAGMAS: dict[str, str] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": "-65536",
+    "mmap_size": "268435456",
+    "temp_store": "MEMORY",
+    "busy_timeout": "30000"
+}
 
 if original_pwd and os.path.exists(original_pwd):
     DEFAULT_DIR = original_pwd
@@ -97,10 +170,31 @@ blip_processor: Any = None
 blip_model: Any = None
 reader: Any = None
 
+# md5 digests are stored as plain hex, like they always were. Digests of every other
+# algorithm are stored as "algorithm:hex", so each row says how it was computed.
+hash_algorithms: list[str] = ["md5", "blake2b"]
+
+if importlib.util.find_spec("xxhash") is not None:
+    hash_algorithms.append("xxh3_128")
+
+face_index_backends: list[str] = ["auto", "ivf", "none"]
+
+if importlib.util.find_spec("hnswlib") is not None:
+    face_index_backends.insert(2, "hnsw")
+
 supported_image_formats: set[str] = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
 allowed_document_extensions: list = ['.doc', '.docx', '.pptx', '.ppt', '.odp', '.odt', '.pdf', '.rtf', '.html']
 
-parser = argparse.ArgumentParser(description="Smart file indexer", formatter_class=RichHelpFormatter)
+@typechecked
+def get_help_formatter() -> type:
+    # rich_argparse is only imported when the help is actually shown
+    if "-h" in sys.argv[1:] or "--help" in sys.argv[1:]:
+        from rich_argparse import RichHelpFormatter
+        return RichHelpFormatter
+
+    return argparse.HelpFormatter
+
+parser = argparse.ArgumentParser(description="Smart file indexer", formatter_class=get_help_formatter())
 
 index_related = parser.add_argument_group("Index Related")
 index_related.add_argument("--index", action="store_true", help="Index images in the specified directory")
@@ -108,11 +202,19 @@ index_related.add_argument("--shuffle_index", action="store_true", help="Shuffle
 index_related.add_argument("--delete_non_existing_files", action="store_true", help="Delete non-existing files")
 index_related.add_argument("--describe", action="store_true", help="Enable image description")
 index_related.add_argument("--documents", action="store_true", help="Enable document indexing")
+index_related.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help=f"Number of worker processes that analyze images while indexing, default: {DEFAULT_JOBS}")
+index_related.add_argument("--commit_every", type=int, default=DEFAULT_COMMIT_EVERY, help=f"Commit buffered index results to the database after this many rows, default: {DEFAULT_COMMIT_EVERY}")
+index_related.add_argument("--commit_interval", type=float, default=DEFAULT_COMMIT_INTERVAL, help=f"Commit buffered index results to the database after this many seconds, default: {DEFAULT_COMMIT_INTERVAL}")
+index_related.add_argument("--hash_algorithm", choices=hash_algorithms, default=DEFAULT_HASH_ALGORITHM, help=f"Algorithm for the content digests of indexed files, default: {DEFAULT_HASH_ALGORITHM}")
+index_related.add_argument("--hash_threads", type=int, default=DEFAULT_HASH_THREADS, help=f"Number of threads that hash files ahead of the analysis while indexing, 0 disables it, default: {DEFAULT_HASH_THREADS}")
 
 search_related = parser.add_argument_group("Search Related")
 search_related.add_argument("search", nargs="*", help="Search term for indexed results", default=[])
 search_related.add_argument("--exact", action="store_true", help="Exact search")
 search_related.add_argument("--full_results", action="store_true", help="Show full results for OCR and file content search, not only the matching lines")
+search_related.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help=f"Show at most this many files, 0 shows all of them, default: {DEFAULT_SEARCH_LIMIT}")
+search_related.add_argument("--offset", type=int, default=0, help="Skip this many of the best ranked files, for showing the next page of results")
+search_related.add_argument("--stream", action="store_true", help="Show every result as soon as it is found, one modality after the other, instead of one list ranked over all modalities")
 
 visualization_related = parser.add_argument_group("Visualization Related")
 visualization_related.add_argument("--size", type=int, default=DEFAULT_SIXEL_WIDTH, help=f"Size to resize images for sixel display (default: {DEFAULT_SIXEL_WIDTH}).")
@@ -120,14 +222,17 @@ visualization_related.add_argument("--no_sixel", action="store_true", help="Hide
 
 debug_related = parser.add_argument_group("Debug & Maintenance")
 debug_related.add_argument("--debug", action="store_true", help="Enable debug mode")
+debug_related.add_argument("--timing", action="store_true", help="Show how long the imports and each step of the startup took")
 debug_related.add_argument("--vacuum", action="store_true", help="Vacuum the SQLite database file (reduces size without deleting data)")
 
 model_related = parser.add_argument_group("Model & Detection")
 model_related.add_argument("--blip_model_name", default=DEFAULT_BLIP_MODEL_NAME, help=f"Name of the blip model. Default: {DEFAULT_BLIP_MODEL_NAME}")
+model_related.add_argument("--blip_batch_size", type=int, default=DEFAULT_BLIP_BATCH_SIZE, help=f"Number of images the blip model describes in one batch while indexing, default: {DEFAULT_BLIP_BATCH_SIZE}")
 model_related.add_argument("--yolo", action="store_true", help="Use YOLO for indexing")
 model_related.add_argument("--yolo_model", default=DEFAULT_MODEL, help="Model to use for detection")
 model_related.add_argument("--yolo_threshold", type=float, default=DEFAULT_YOLO_THRESHOLD, help=f"YOLO confidence threshold (0-1), default: {DEFAULT_YOLO_THRESHOLD}")
 model_related.add_argument("--yolo_min_confidence_for_saving", type=float, default=DEFAULT_MIN_CONFIDENCE_FOR_SAVING, help=f"Min YOLO confidence to save detections (0-1), default: {DEFAULT_MIN_CONFIDENCE_FOR_SAVING}")
+model_related.add_argument("--yolo_batch_size", type=int, default=DEFAULT_YOLO_BATCH_SIZE, help=f"Number of images YOLO analyzes in one forward pass while indexing, default: {DEFAULT_YOLO_BATCH_SIZE}")
 
 ocr_related = parser.add_argument_group("OCR")
 ocr_related.add_argument("--ocr", action="store_true", help="Enable OCR")
@@ -136,8 +241,17 @@ ocr_related.add_argument("--lang_ocr", nargs='+', default=[], help=f"OCR languag
 face_related = parser.add_argument_group("Face Recognition")
 face_related.add_argument("--face_recognition", action="store_true", help="Enable face recognition (needs user interaction)")
 face_related.add_argument("--encoding_face_recognition_file", default=DEFAULT_ENCODINGS_FILE, help=f"Default file for saving encodings (default: {DEFAULT_ENCODINGS_FILE})")
+face_related.add_argument("--face_model", choices=["hog", "cnn"], default=DEFAULT_FACE_MODEL, help=f"Face detector, cnn is more accurate but much slower without a GPU, default: {DEFAULT_FACE_MODEL}")
+face_related.add_argument("--face_upsample", type=int, default=DEFAULT_FACE_UPSAMPLE, help=f"How often the image is upsampled to find smaller faces, default: {DEFAULT_FACE_UPSAMPLE}")
+face_related.add_argument("--face_detection_max_size", type=int, default=DEFAULT_FACE_DETECTION_MAX_SIZE, help=f"Find faces on a copy of the image downscaled to this many pixels on its longer side, 0 uses the full size. The encodings are still computed at full size, default: {DEFAULT_FACE_DETECTION_MAX_SIZE}")
+face_related.add_argument("--benchmark_face_detection", action="store_true", help="Only time the face detection on the images in --dir with the current face options and report the time per megapixel")
+face_related.add_argument("--face_crop_dir", default=DEFAULT_FACE_CROP_DIR, help=f"Cache directory for the small face crops shown when asking for names, can be deleted at any time (default: {DEFAULT_FACE_CROP_DIR})")
 face_related.add_argument("--tolerance_face_detection", type=float, default=DEFAULT_TOLERANCE_FACE_DETECTION, help=f"Tolerance for face detection (0-1), default: {DEFAULT_TOLERANCE_FACE_DETECTION}")
+face_related.add_argument("--face_index", choices=face_index_backends, default="auto", help="Approximate nearest neighbour index for large face galleries. auto uses hnsw when hnswlib is installed and ivf otherwise, none always compares with every known face")
+face_related.add_argument("--face_index_min_size", type=int, default=DEFAULT_FACE_INDEX_MIN_SIZE, help=f"Number of known face encodings from which on --face_index is used, default: {DEFAULT_FACE_INDEX_MIN_SIZE}")
 face_related.add_argument("--dont_ask_new_faces", action="store_true", help="Don't ask for new faces (useful for automatic tagging)")
+face_related.add_argument("--cluster_unknown_faces", action="store_true", help="Find the faces of all images first, then group the unknown ones and ask only once per group of similar faces")
+face_related.add_argument("--label_faces", action="store_true", help="Ask for the names of faces that were found while indexing but could not be recognized, without indexing anything")
 face_related.add_argument("--dont_save_new_encoding", action="store_true", help="Don't save new encodings for faces automatically")
 face_related.add_argument("--person_delete", type=str, default=None, help="person_delete")
 
@@ -150,11 +264,14 @@ crontab_related.add_argument("--run_hourly", action="store_true", help="Allows y
 file_handling_related = parser.add_argument_group("File Handling")
 file_handling_related.add_argument("--dir", default=None, help="Directory to search or index")
 file_handling_related.add_argument("--dbfile", default=DEFAULT_DB_PATH, help="Path to the SQLite database file")
+file_handling_related.add_argument("--sqlite_pragma", action='append', default=[], help=f"Override an SQLite pragma as NAME=VALUE. Can be used multiple times. Defaults: {', '.join(f'{k}={v}' for k, v in DEFAULT_SQLITE_PRAGMAS.items())}")
 file_handling_related.add_argument("--exclude", action='append', default=[], help="Folders or paths to ignore. Can be used multiple times.")
 file_handling_related.add_argument("--max_size", type=int, default=DEFAULT_MAX_SIZE, help=f"Max size in MB (default: {DEFAULT_MAX_SIZE})")
 
 args = parser.parse_args()
 
+add_step_time("parse arguments")
+
 do_all = not args.describe and not args.ocr and not args.yolo and not args.face_recognition and not args.documents and not args.qrcodes
 
 @typechecked
@@ -195,6 +312,59 @@ if not 0 < args.max_size:
     console.print(f"[red]--max_size must be greater than 0, is set to {args.max_size}[/]")
     sys.exit(2)
 
+if not 0 < args.yolo_batch_size:
+    console.print(f"[red]--yolo_batch_size must be greater than 0, is set to {args.yolo_batch_size}[/]")
+    sys.exit(2)
+
+if not 0 < args.blip_batch_size:
+    console.print(f"[red]--blip_batch_size must be greater than 0, is set to {args.blip_batch_size}[/]")
+    sys.exit(2)
+
+if not 0 < args.jobs:
+    console.print(f"[red]--jobs must be greater than 0, is set to {args.jobs}[/]")
+    sys.exit(2)
+
+if not 0 < args.commit_every:
+    console.print(f"[red]--commit_every must be greater than 0, is set to {args.commit_every}[/]")
+    sys.exit(2)
+
+if not 0 < args.commit_interval:
+    console.print(f"[red]--commit_interval must be greater than 0, is set to {args.commit_interval}[/]")
+    sys.exit(2)
+
+if not 0 <= args.face_upsample:
+    console.print(f"[red]--face_upsample must be 0 or greater, is set to {args.face_upsample}[/]")
+    sys.exit(2)
+
+if not 0 <= args.face_detection_max_size:
+    console.print(f"[red]--face_detection_max_size must be 0 or greater, is set to {args.face_detection_max_size}[/]")
+    sys.exit(2)
+
+if not 0 < args.face_index_min_size:
+    console.print(f"[red]--face_index_min_size must be greater than 0, is set to {args.face_index_min_size}[/]")
+    sys.exit(2)
+
+if not 0 <= args.limit:
+    console.print(f"[red]--limit must be 0 or greater, is set to {args.limit}[/]")
+    sys.exit(2)
+
+if not 0 <= args.offset:
+    console.print(f"[red]--offset must be 0 or greater, is set to {args.offset}[/]")
+    sys.exit(2)
+
+if not 0 <= args.hash_threads:
+    console.print(f"[red]--hash_threads must be 0 or greater, is set to {args.hash_threads}[/]")
+    sys.exit(2)
+
+sqlite_pragmas: dict[str, str] = dict(DEFAULT_SQLITE_PRAGMAS)
+
+for sqlite_pragma in args.sqlite_pragma:
+    pragma_name, _, pragma_value = sqlite_pragma.partition("=")
+    if not pragma_name.isidentifier() or not re.fullmatch(r"[\w.-]+", pragma_value):
+        console.print(f"[red]--sqlite_pragma must look like NAME=VALUE, is set to {sqlite_pragma}[/]")
+        sys.exit(2)
+    sqlite_pragmas[pragma_name] = pragma_value
+
 if original_pwd is not None and os.path.exists(original_pwd):
     dbg(f"Changing dir to {original_pwd}")
     os.chdir(original_pwd)
@@ -252,17 +422,14 @@ if args.dir is not None and not os.path.exists(args.dir):
     console.print(f"[red]--dir refers to a directory that doesn't exist: {args.dir}[/]")
     sys.exit(2)
 
+# --exclude as absolute paths, resolved once instead of for every file
+excluded_paths: list[str] = [to_absolute_path(excl) for excl in args.exclude]
+
 yolo_error_already_shown: bool = False
 
-dbg("Finished declaring global variables")
+sixel_supported: Optional[bool] = None
 
-@typechecked
-def show(path: str) -> bool:
-    if args.dir:
-        if path.startswith(args.dir):
-            return True
-        return False
-    return True
+dbg("Finished declaring global variables")
 
 @typechecked
 def conn_execute(conn: sqlite3.Connection, query: str) -> sqlite3.Cursor:
@@ -326,82 +493,115 @@ def cursor_execute(cursor: sqlite3.Cursor, query: str, entries: Optional[tuple]
 
 @typechecked
 def supports_sixel() -> bool:
+    global sixel_supported
+
+    # Asking tput takes a subprocess, so it's done at most once, and only when an image is about to be shown
+    if sixel_supported is not None:
+        return sixel_supported
+
+    sixel_supported = False
+
     term = os.environ.get("TERM", "").lower()
     if "xterm" in term or "mlterm" in term:
-        return True
+        sixel_supported = True
+        return sixel_supported
 
     try:
         output = subprocess.run(["tput", "setab", "256"], capture_output=True, text=True, check=True)
         if output.returncode == 0 and "sixel" in output.stdout.lower():
-            return True
+            sixel_supported = True
     except (subprocess.CalledProcessError, FileNotFoundError):
         pass
 
-    return False
+    return sixel_supported
+
+@typechecked
+def shows_sixel() -> bool:
+    if not args.no_sixel and not supports_sixel():
+        console.print("[red]Cannot use sixel. Will set --no_sixel to true.[/]")
+
+        args.no_sixel = True
+
+    return not args.no_sixel
 
 dbg("Defining console")
 console = Console()
 
-if not supports_sixel() and not args.no_sixel:
-    console.print("[red]Cannot use sixel. Will set --no_sixel to true.[/]")
+class DecodedImage:
+    # Decodes an image file once and hands out the pixel formats the different
+    # analyzers need. Conversions are done lazily and cached until close().
+    def __init__(self, image_path: str) -> None:
+        self.image_path = image_path
+        self._pil: Any = None
+        self._error: Optional[Exception] = None
+        self._arrays: dict[str, numpy.ndarray] = {}
 
-    args.no_sixel = True
+    @property
+    def pil(self) -> Any:
+        import PIL.Image
 
-dbg("Loading further modules")
-try:
-    with console.status("[bold green]Loading pickle..."):
-        import pickle
+        if self._error is not None:
+            raise self._error
 
-    if args.index:
-        if args.yolo:
-            with console.status("[bold green]Loading yolov5..."):
-                import yolov5
+        if self._pil is None:
+            try:
+                with PIL.Image.open(self.image_path) as img:
+                    self._pil = img.convert("RGB")
+            except Exception as e:
+                self._error = e
+                raise
 
-        if args.ocr:
-            with console.status("[bold green]Loading easyocr..."):
-                import easyocr
+        return self._pil
 
-            with console.status("[bold green]Loading reader..."):
-                try:
-                    reader = easyocr.Reader(args.lang_ocr)
-                except ValueError as e:
-                    console.print(f"[red]Loading OCR failed. This is probably an error with the --lang_ocr option. Error:[/] {e}")
+    @property
+    def rgb(self) -> numpy.ndarray:
+        import numpy
 
-        if args.ocr or args.face_recognition:
-            with console.status("[bold green]Loading face_recognition..."):
-                import face_recognition
+        if "rgb" not in self._arrays:
+            self._arrays["rgb"] = numpy.array(self.pil)
+        return self._arrays["rgb"]
 
-        if args.describe or do_all:
-            with console.status("[bold green]Loading transformers..."):
-                import transformers
+    @property
+    def bgr(self) -> numpy.ndarray:
+        import cv2
 
-            with console.status("[bold green]Loading Blip-Transformers...") as load_status:
-                from transformers import BlipProcessor, BlipForConditionalGeneration
+        if "bgr" not in self._arrays:
+            self._arrays["bgr"] = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR)
+        return self._arrays["bgr"]
 
-            with console.status("[bold green]Loading Blip-Models..."):
-                try:
-                    blip_processor = BlipProcessor.from_pretrained(args.blip_model_name)
-                except OSError as e:
-                    console.print(f"[red]Loading BlipProcessor failed with this error:[/] {e}")
+    @property
+    def gray(self) -> numpy.ndarray:
+        import cv2
 
-                try:
-                    blip_model = BlipForConditionalGeneration.from_pretrained(args.blip_model_name)
-                except OSError as e:
-                    console.print(f"[red]Loading BlipModel failed with this error:[/] {e}")
-except ModuleNotFoundError as e:
-    console.print(f"[red]Module not found:[/] {e}")
-    sys.exit(1)
-except KeyboardInterrupt:
-    console.print("\n[red]You pressed CTRL+C[/]")
-    sys.exit(0)
+        if "gray" not in self._arrays:
+            self._arrays["gray"] = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+        return self._arrays["gray"]
+
+    def thumbnail(self, max_size: int) -> Any:
+        width, height = self.pil.size
+        scale = min(1.0, max_size / max(width, height))
+        return self.pil.resize((max(1, int(width * scale)), max(1, int(height * scale))))
+
+    def close(self) -> None:
+        if self._pil is not None:
+            self._pil.close()
+        self._pil = None
+        self._arrays = {}
+
+    def __enter__(self) -> "DecodedImage":
+        return self
 
-dbg("Done loading further modules")
+    def __exit__(self, exc_type: Any, exc_value: Any, exc_traceback: Any) -> None:
+        self.close()
 
 @typechecked
-def get_qr_codes_from_image(file_path: str) -> list[str]:
+def get_qr_codes_from_image(file_path: str, frame: Optional[DecodedImage] = None) -> list[str]:
+    import PIL.Image
+    from pyzbar.pyzbar import decode
+
     try:
         try:
-            img = PIL.Image.open(file_path)
+            img: Any = frame.gray if frame is not None else PIL.Image.open(file_path)
         except Exception as e:
             raise ValueError(f'Image could not be loaded: {e}') from e
 
@@ -421,14 +621,22 @@ def get_qr_codes_from_image(file_path: str) -> list[str]:
 
 @typechecked
 def qr_code_already_existing(conn: sqlite3.Connection, image_path: str) -> bool:
+    indexed = is_in_indexed_stage("qrcodes", image_path)
+    if indexed is not None:
+        return indexed
+
+    file_id = find_file_id(conn, image_path)
+    if file_id is None:
+        return False
+
     cursor = conn.cursor()
 
-    cursor_execute(cursor, 'SELECT 1 FROM no_qrcodes WHERE file_path = ?', (image_path,))
+    cursor_execute(cursor, 'SELECT 1 FROM no_qrcodes WHERE file_id = ?', (file_id,))
     if cursor.fetchone():
         cursor.close()
         return True
 
-    cursor_execute(cursor, 'SELECT 1 FROM qrcodes JOIN images ON images.id = qrcodes.image_id WHERE images.file_path = ?', (image_path,))
+    cursor_execute(cursor, 'SELECT 1 FROM qrcodes JOIN images ON images.id = qrcodes.image_id WHERE images.file_id = ?', (file_id,))
     if cursor.fetchone():
         cursor.close()
         return True
@@ -437,13 +645,16 @@ def qr_code_already_existing(conn: sqlite3.Connection, image_path: str) -> bool:
     return False
 
 @typechecked
-def add_qrcodes_from_image(conn: sqlite3.Connection, file_path: str) -> None:
-    if qr_code_already_existing(conn, file_path):
-        console.print(f"[yellow]File {file_path} has already been searched for Qr-Codes[/]")
-        return
+def add_qrcodes_from_image(conn: sqlite3.Connection, file_path: str, frame: Optional[DecodedImage] = None, precomputed: Optional[dict] = None) -> None:
+    if precomputed is not None and "qrcodes" in precomputed:
+        qr_codes = precomputed["qrcodes"]
+    else:
+        if qr_code_already_existing(conn, file_path):
+            console.print(f"[yellow]File {file_path} has already been searched for Qr-Codes[/]")
+            return
 
-    console.print(f"[green]Searching for Qr-Codes in {file_path}[/]")
-    qr_codes = get_qr_codes_from_image(file_path)
+        console.print(f"[green]Searching for Qr-Codes in {file_path}[/]")
+        qr_codes = get_qr_codes_from_image(file_path, frame)
 
     if len(qr_codes):
         for q in qr_codes:
@@ -454,23 +665,24 @@ def add_qrcodes_from_image(conn: sqlite3.Connection, file_path: str) -> None:
 
 @typechecked
 def add_qrcode_to_image(conn: sqlite3.Connection, file_path: str, content: str) -> None:
+    file_id = get_file_id(conn, file_path)
     cursor = conn.cursor()
 
     while True:
         try:
-            cursor_execute(cursor, 'SELECT id FROM images WHERE file_path = ?', (file_path,))
+            cursor_execute(cursor, 'SELECT id FROM images WHERE file_id = ?', (file_id,))
             image_id = cursor.fetchone()
 
             if not image_id:
-                cursor_execute(cursor, 'INSERT INTO images (file_path) VALUES (?)', (file_path,))
-                conn.commit()
+                cursor_execute(cursor, 'INSERT INTO images (file_id) VALUES (?)', (file_id,))
+                commit_unless_batching(conn)
                 image_id = cursor.lastrowid
-                conn.commit()
+                commit_unless_batching(conn)
             else:
                 image_id = image_id[0]
 
             cursor_execute(cursor, 'INSERT OR IGNORE INTO qrcodes (image_id, content) VALUES (?, ?)', (image_id, content))
-            conn.commit()
+            commit_unless_batching(conn)
 
             cursor.close()
             return
@@ -484,12 +696,36 @@ def add_qrcode_to_image(conn: sqlite3.Connection, file_path: str, content: str)
                 sys.exit(13)
 
 @typechecked
-def extract_face_encodings(image_path: str) -> tuple[list, list]:
+def detect_face_locations(image: numpy.ndarray) -> list:
+    import cv2
+    import face_recognition
+
+    height, width = image.shape[:2]
+    scale = 1.0
+
+    if args.face_detection_max_size and max(height, width) > args.face_detection_max_size:
+        scale = args.face_detection_max_size / max(height, width)
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    face_locations = face_recognition.face_locations(image, number_of_times_to_upsample=args.face_upsample, model=args.face_model)
+
+    if scale == 1.0:
+        return face_locations
+
+    # Map the boxes back onto the full size image
+    return [(max(0, int(top / scale)), min(width, int(right / scale)), min(height, int(bottom / scale)), max(0, int(left / scale))) for top, right, bottom, left in face_locations]
+
+@typechecked
+def extract_face_encodings(image_path: str, frame: Optional[DecodedImage] = None) -> tuple[list, list]:
+    import PIL.Image
     import face_recognition
 
     try:
-        image = face_recognition.load_image_file(image_path)
-        face_locations = face_recognition.face_locations(image)
+        if frame is not None:
+            image = frame.rgb
+        else:
+            image = face_recognition.load_image_file(image_path)
+        face_locations = detect_face_locations(image)
         face_encodings = face_recognition.face_encodings(image, face_locations)
 
         return face_encodings, face_locations
@@ -498,18 +734,22 @@ def extract_face_encodings(image_path: str) -> tuple[list, list]:
         return ([], [],)
 
 @typechecked
-def compare_faces(known_encodings: list, unknown_encoding: numpy.ndarray, tolerance: float = args.tolerance_face_detection) -> list:
-    import face_recognition
+def face_distances(known_encodings: numpy.ndarray, unknown_encodings: numpy.ndarray) -> numpy.ndarray:
+    import numpy
 
-    results = face_recognition.compare_faces(known_encodings, unknown_encoding, tolerance)
+    # Euclidean distance of every unknown to every known encoding, shape (unknown, known),
+    # as |a|^2 + |b|^2 - 2ab so no (unknown, known, 128) array has to be built
+    squared = (unknown_encodings ** 2).sum(axis=1)[:, None] + (known_encodings ** 2).sum(axis=1)[None, :] - 2 * unknown_encodings @ known_encodings.T
 
-    return results
+    return numpy.sqrt(numpy.maximum(squared, 0))
 
 @typechecked
 def save_encodings(encodings: dict, file_name: str) -> None:
     if not args.dont_save_new_encoding:
-        with open(file_name, "wb") as file:
+        tmp_file_name = f"{file_name}.tmp"
+        with open(tmp_file_name, "wb") as file:
             pickle.dump(encodings, file)
+        os.replace(tmp_file_name, file_name)
 
 @typechecked
 def load_encodings(file_name: str) -> dict:
@@ -519,87 +759,329 @@ def load_encodings(file_name: str) -> dict:
     return {}
 
 @typechecked
-def detect_faces_and_name_them_when_needed(image_path: str, known_encodings: dict, tolerance: float = args.tolerance_face_detection, progress: Any = None) -> Optional[tuple[list[str], dict, bool]]:
-    try:
-        face_encodings, face_locations = extract_face_encodings(image_path)
+def train_ivf_centroids(matrix: numpy.ndarray) -> numpy.ndarray:
+    import numpy
 
-        manually_entered_name = False
+    # k-means on a sample of the encodings, about sqrt(n) lists with a few dozen encodings each
+    rng = numpy.random.default_rng(0)
+    nr_lists = max(1, int(numpy.sqrt(len(matrix))))
+    sample = matrix[rng.choice(len(matrix), min(len(matrix), nr_lists * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), nr_lists, replace=False)].copy()
 
-        new_ids = []
+    for _ in range(IVF_KMEANS_ITERATIONS):
+        labels = numpy.argmin(face_distances(centroids, sample), axis=1)
+        sums = numpy.zeros_like(centroids)
+        numpy.add.at(sums, labels, sample)
+        counts = numpy.bincount(labels, minlength=nr_lists)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
 
-        c = 0
+    return centroids
 
-        nr_new_faces = 0
+@typechecked
+def assign_ivf_lists(centroids: numpy.ndarray, vectors: numpy.ndarray) -> numpy.ndarray:
+    import numpy
 
-        for face_encoding in face_encodings:
-            matches = compare_faces(list(known_encodings.values()), face_encoding, tolerance)
+    return numpy.argmin(face_distances(centroids, vectors), axis=1).astype(numpy.int32)
 
-            this_face_location = face_locations[c]
+@typechecked
+def search_ivf(matrix: numpy.ndarray, centroids: numpy.ndarray, assignments: numpy.ndarray, faces: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    import numpy
 
-            if True in matches:
-                matched_id = list(known_encodings.keys())[matches.index(True)]
-                new_ids.append(matched_id)
+    probes = numpy.argsort(face_distances(centroids, faces), axis=1)[:, :IVF_NPROBE]
+
+    nearest = numpy.zeros(len(faces), dtype=numpy.int64)
+    distances = numpy.full(len(faces), numpy.inf, dtype=numpy.float32)
+
+    for row, face in enumerate(faces):
+        candidates = numpy.flatnonzero(numpy.isin(assignments, probes[row]))
+
+        if len(candidates):
+            candidate_distances = face_distances(matrix[candidates], face[None, :])[0]
+            best = numpy.argmin(candidate_distances)
+            nearest[row] = candidates[best]
+            distances[row] = candidate_distances[best]
+
+    return nearest, distances
+
+class FaceIndex:
+    # Approximate nearest neighbour search over the rows of the gallery matrix, either
+    # with hnswlib or with a NumPy IVF index (k-means lists, only the lists nearest to
+    # a face are searched). Saved next to the encodings file, with a digest of the
+    # matrix it was built for, so a stale index is never used.
+    def __init__(self, file_name: str) -> None:
+        self.file_name = f"{file_name}.index"
+        self.backend = args.face_index
+        if self.backend == "auto":
+            self.backend = "hnsw" if "hnsw" in face_index_backends else "ivf"
+        self.state: dict = {}
+        self.changed = False
+
+    def build(self, matrix: numpy.ndarray) -> None:
+        import numpy
+
+        with console.status(f"[bold green]Building {self.backend} index for {len(matrix)} face encodings..."):
+            if self.backend == "hnsw":
+                import hnswlib
+                index = hnswlib.Index(space="l2", dim=FACE_ENCODING_SIZE)
+                index.init_index(max_elements=len(matrix) * 2, ef_construction=200, M=16)
+                index.add_items(matrix, numpy.arange(len(matrix)))
+                # hnswlib labels can't change, so rows maps each label to its current matrix row
+                self.state = {"index": index, "rows": numpy.arange(len(matrix))}
             else:
-                if c == 0:
-                    print_file_title("Face-Detection", image_path)
-                    display_sixel(image_path)
+                centroids = train_ivf_centroids(matrix)
+                self.state = {"centroids": centroids, "assignments": assign_ivf_lists(centroids, matrix)}
+
+        self.changed = True
+
+    def load(self, matrix: numpy.ndarray) -> bool:
+        if not os.path.exists(self.file_name):
+            return False
+
+        try:
+            with open(self.file_name, "rb") as file:
+                saved = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ModuleNotFoundError) as e:
+            dbg(f"Could not load {self.file_name}: {e}")
+            return False
+
+        if saved.get("backend") != self.backend or saved.get("matrix_digest") != hashlib.blake2b(matrix.tobytes()).hexdigest():
+            return False
+
+        self.state = saved["state"]
+        return True
+
+    def save(self, matrix: numpy.ndarray) -> None:
+        if not self.changed:
+            return
+
+        tmp_file_name = f"{self.file_name}.tmp"
+        with open(tmp_file_name, "wb") as file:
+            pickle.dump({"backend": self.backend, "matrix_digest": hashlib.blake2b(matrix.tobytes()).hexdigest(), "state": self.state}, file)
+        os.replace(tmp_file_name, self.file_name)
+
+        self.changed = False
+
+    def add(self, row: int, vector: numpy.ndarray) -> None:
+        import numpy
+
+        # vector was inserted into the matrix at row, the rows after it moved down by one
+        if self.backend == "hnsw":
+            index = self.state["index"]
+            rows = self.state["rows"]
+            if index.get_current_count() + 1 > index.get_max_elements():
+                index.resize_index((index.get_current_count() + 1) * 2)
+            rows[rows >= row] += 1
+            index.add_items(vector, [len(rows)])
+            self.state["rows"] = numpy.append(rows, row)
+        else:
+            self.state["assignments"] = numpy.insert(self.state["assignments"], row, assign_ivf_lists(self.state["centroids"], vector))
+
+        self.changed = True
+
+    def search(self, matrix: numpy.ndarray, faces: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        import numpy
+
+        if self.backend == "hnsw":
+            index = self.state["index"]
+            index.set_ef(64)
+            labels, squared_distances = index.knn_query(faces, k=1)
+            return self.state["rows"][labels[:, 0]], numpy.sqrt(squared_distances[:, 0])
+
+        return search_ivf(matrix, self.state["centroids"], self.state["assignments"], faces)
+
+class FaceGallery:
+    # All known face encodings, a list of them per name, loaded once per run. The pkl
+    # file holds the compacted gallery. Changes are appended to a log file next to it,
+    # so a new face doesn't rewrite the whole gallery, and are merged into the pkl by
+    # compact().
+    def __init__(self, file_name: str) -> None:
+        import numpy
+
+        self.file_name = file_name
+        self.log_file_name = f"{file_name}.log"
+        self.encodings: dict[str, list] = {}
+        self._nr_log_entries = 0
+
+        for name, encodings in load_encodings(file_name).items():
+            # Older files have exactly one encoding per name
+            self.encodings[name] = list(encodings) if isinstance(encodings, list) else [encodings]
+
+        # The same encodings as one contiguous matrix, row i belongs to names[i]
+        self.names: list[str] = []
+        self.matrix: numpy.ndarray = numpy.empty((0, FACE_ENCODING_SIZE), dtype=numpy.float32)
+
+        # Only used once the gallery has at least --face_index_min_size encodings
+        self.index: Optional[FaceIndex] = None
+
+        self._replay_log()
+        self._rebuild_matrix()
+
+    def _rebuild_matrix(self) -> None:
+        import numpy
 
-                if args.dont_ask_new_faces:
-                    if nr_new_faces == 0:
-                        console.print(f"[yellow]Ignoring face(s) detected {image_path}, since --dont_ask_new_faces was set and new faces were detected[/]")
+        self.names = [name for name, encodings in self.encodings.items() for _ in encodings]
+        self.matrix = numpy.array([encoding for encodings in self.encodings.values() for encoding in encodings], dtype=numpy.float32).reshape(-1, FACE_ENCODING_SIZE)
+
+        # Rows may have moved, so the index has to be built again when it's needed
+        self.index = None
+
+    def _get_index(self) -> Optional[FaceIndex]:
+        if args.face_index == "none" or len(self.names) < args.face_index_min_size:
+            return None
+
+        if self.index is None:
+            self.index = FaceIndex(self.file_name)
+
+            if not self.index.load(self.matrix):
+                self.index.build(self.matrix)
+
+        return self.index
+
+    def _replay_log(self) -> None:
+        if not os.path.exists(self.log_file_name):
+            return
+
+        with open(self.log_file_name, "rb") as file:
+            while True:
+                try:
+                    name, encoding = pickle.load(file)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError) as e:
+                    # A run that was killed while appending leaves a cut off last entry
+                    console.print(f"[yellow]Ignoring the rest of {self.log_file_name}: {e}[/]")
+                    break
+
+                if encoding is None:
+                    self.encodings.pop(name, None)
                 else:
-                    display_sixel_part(image_path, this_face_location)
-                    try:
-                        ask_string = "What is this person's name? [Just press enter if no person is visible or you don't want the person to be saved] "
-                        if progress:
-                            with PauseProgress(progress):
-                                new_id = input(ask_string)
-                        else:
-                            new_id = input(ask_string)
-                        if any(char.strip() for char in new_id):
-                            known_encodings[new_id] = face_encoding
-                            new_ids.append(new_id)
+                    self.encodings.setdefault(name, []).append(encoding)
 
-                            manually_entered_name = True
-                        else:
-                            console.print(f"[yellow]Ignoring wrongly detected face in {image_path}[/]")
-                    except EOFError:
-                        console.print("[red]You pressed CTRL+d[/]")
-                        sys.exit(0)
-                nr_new_faces = nr_new_faces + 1
-            c = c + 1
-
-        return new_ids, known_encodings, manually_entered_name
-    except PIL.UnidentifiedImageError:
-        return None
+                self._nr_log_entries = self._nr_log_entries + 1
 
-    return None
+    def _append_to_log(self, name: str, encoding: Optional[numpy.ndarray]) -> None:
+        if args.dont_save_new_encoding:
+            return
+
+        with open(self.log_file_name, "ab") as file:
+            pickle.dump((name, encoding), file)
+
+        self._nr_log_entries = self._nr_log_entries + 1
+
+    def add(self, name: str, encoding: numpy.ndarray) -> None:
+        import numpy
+
+        # A person that is named again gets another encoding, e.g. for other lighting.
+        # The rows of a person stay together, in the order of self.encodings.
+        self.encodings.setdefault(name, []).append(encoding)
+        self._append_to_log(name, encoding)
+
+        row = 0
+        for known_name, encodings in self.encodings.items():
+            row = row + len(encodings)
+            if known_name == name:
+                break
+        row = row - 1
+
+        new_row = numpy.asarray(encoding, dtype=numpy.float32).reshape(1, FACE_ENCODING_SIZE)
+
+        self.names.insert(row, name)
+        self.matrix = numpy.insert(self.matrix, row, new_row, axis=0)
+
+        if self.index is not None:
+            self.index.add(row, new_row)
+
+    def delete(self, name: str) -> None:
+        del self.encodings[name]
+        self._append_to_log(name, None)
+        self._rebuild_matrix()
+
+    def match(self, face_encodings: list, tolerance: float) -> list[Optional[str]]:
+        import numpy
+
+        # Name of the nearest known encoding for every face, or None if even the
+        # nearest one is farther away than the tolerance
+        if len(face_encodings) == 0 or len(self.names) == 0:
+            return [None] * len(face_encodings)
+
+        faces = numpy.array(face_encodings, dtype=numpy.float32).reshape(-1, FACE_ENCODING_SIZE)
+
+        index = self._get_index()
+
+        if index is not None:
+            nearest, nearest_distances = index.search(self.matrix, faces)
+        else:
+            distances = face_distances(self.matrix, faces)
+            nearest = numpy.argmin(distances, axis=1)
+            nearest_distances = distances[numpy.arange(len(faces)), nearest]
+
+        return [self.names[index] if distance <= tolerance else None for index, distance in zip(nearest, nearest_distances)]
+
+    def compact(self) -> None:
+        if self.index is not None and not args.dont_save_new_encoding:
+            self.index.save(self.matrix)
+
+        if self._nr_log_entries == 0 or args.dont_save_new_encoding:
+            return
+
+        save_encodings(self.encodings, self.file_name)
+        os.unlink(self.log_file_name)
+
+        self._nr_log_entries = 0
+
+face_gallery: Optional[FaceGallery] = None
+
+@typechecked
+def get_face_gallery() -> FaceGallery:
+    global face_gallery
+
+    if face_gallery is None:
+        face_gallery = FaceGallery(args.encoding_face_recognition_file)
+
+    return face_gallery
+
+@typechecked
+def compact_face_gallery() -> None:
+    if face_gallery is not None:
+        face_gallery.compact()
 
 @typechecked
-def recognize_persons_in_image(conn: sqlite3.Connection, image_path: str, progress: Any = None) -> Optional[tuple[list[str], bool]]:
-    known_encodings = load_encodings(args.encoding_face_recognition_file)
+def extract_faces(image_path: str, frame: DecodedImage) -> tuple[list, list, list]:
+    # Encodings, locations and crop hashes of all faces in the image
+    face_encodings, face_locations = extract_face_encodings(image_path, frame)
 
-    recognized_faces = detect_faces_and_name_them_when_needed(image_path, known_encodings, args.tolerance_face_detection, progress)
+    return face_encodings, face_locations, [save_face_crop(frame, location) for location in face_locations]
 
-    if recognized_faces is not None:
-        new_ids, known_encodings, manually_entered_name = recognized_faces
-        console.print(f"[green]{image_path}: {new_ids}[/]")
+@typechecked
+def recognize_persons_in_image(conn: sqlite3.Connection, image_path: str, progress: Any = None, frame: Optional[DecodedImage] = None) -> Optional[tuple[list[str], bool]]:
+    import PIL.Image
 
-        if len(new_ids):
-            add_image_persons_mapping(conn, image_path, new_ids)
+    try:
+        if frame is not None:
+            extracted = extract_faces(image_path, frame)
         else:
-            insert_into_no_faces(conn, image_path)
+            with DecodedImage(image_path) as new_frame:
+                extracted = extract_faces(image_path, new_frame)
+    except PIL.UnidentifiedImageError:
+        return None
 
-        save_encodings(known_encodings, args.encoding_face_recognition_file)
+    store_extracted_faces(conn, image_path, *extracted)
 
-        return new_ids, manually_entered_name
+    manually_entered_name = label_unknown_faces(conn, progress, [image_path])
 
-    return None
+    new_ids = get_persons_in_image(conn, image_path)
+    console.print(f"[green]{image_path}: {new_ids}[/]")
+
+    return new_ids, manually_entered_name
 
 #@typechecked
-def ocr_img(img: str) -> Optional[list[str]]:
+def ocr_img(img: str, frame: Optional[DecodedImage] = None) -> Optional[list[str]]:
     global reader
 
+    import cv2
+    import PIL.Image
+
     try:
         if reader is None:
             if "easyocr" not in sys.modules:
@@ -616,7 +1098,10 @@ def ocr_img(img: str) -> Optional[list[str]]:
 
         if os.path.exists(img):
             console.print(f"[yellow]Trying to OCR {img}[/]")
-            result = reader.readtext(img)
+            if frame is not None:
+                result = reader.readtext(frame.rgb)
+            else:
+                result = reader.readtext(img)
             console.print(f"[green]OCR {img} done.[/]")
 
             return result
@@ -629,6 +1114,8 @@ def ocr_img(img: str) -> Optional[list[str]]:
 
 @typechecked
 def resize_image(input_path: str, output_path: str, max_size: int) -> bool:
+    import PIL.Image
+
     try:
         with PIL.Image.open(input_path) as img:
             img.thumbnail((max_size, max_size))
@@ -641,13 +1128,96 @@ def resize_image(input_path: str, output_path: str, max_size: int) -> bool:
     return False
 
 @typechecked
-def display_sixel_part(image_path: str, location: Union[tuple, list]) -> None:
+def resize_frame(frame: DecodedImage, output_path: str, max_size: int) -> bool:
+    import PIL.Image
+
+    try:
+        frame.thumbnail(max_size).save(output_path)
+
+        return True
+    except (PIL.Image.DecompressionBombError, OSError) as e:
+        console.print(f"[red]resize_frame(frame = {frame.image_path}, output_path = {output_path}, max_size = {max_size}) failed with error: {e}[/]")
+
+    return False
+
+@typechecked
+def get_face_crop_path(crop_hash: str, extension: str = "jpg") -> str:
+    return os.path.join(args.face_crop_dir, crop_hash[:2], f"{crop_hash}.{extension}")
+
+@typechecked
+def write_file_atomically(file_path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    tmp_file_name = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_file_name, "wb") as file:
+        file.write(content)
+    os.replace(tmp_file_name, file_path)
+
+@typechecked
+def save_face_crop(frame: DecodedImage, location: Union[tuple, list]) -> Optional[str]:
+    # Saves a small JPEG of the face (with some margin) under the hash of its content,
+    # so the same crop is only stored once. Returns the hash.
+    top, right, bottom, left = location
+    margin = int(max(bottom - top, right - left) * FACE_CROP_MARGIN)
+
+    try:
+        width, height = frame.pil.size
+        crop = frame.pil.crop((max(0, left - margin), max(0, top - margin), min(width, right + margin), min(height, bottom + margin)))
+        crop.thumbnail((FACE_CROP_SIZE, FACE_CROP_SIZE))
+
+        buffer = io.BytesIO()
+        crop.save(buffer, format="JPEG", quality=85)
+        content = buffer.getvalue()
+
+        crop_hash = hashlib.sha1(content).hexdigest()
+        crop_path = get_face_crop_path(crop_hash)
+
+        if not os.path.exists(crop_path):
+            write_file_atomically(crop_path, content)
+
+        return crop_hash
+    except (OSError, ValueError) as e:
+        console.print(f"[yellow]Could not save the face crop of {frame.image_path}: {e}[/]")
+
+    return None
+
+@typechecked
+def display_face_crop(crop_hash: str) -> bool:
+    import PIL.Image
+    from sixel import converter
+
+    # The sixel output of a crop is cached next to it, so showing it again needs no conversion
+    crop_path = get_face_crop_path(crop_hash)
+    sixel_path = get_face_crop_path(crop_hash, "six")
+
+    if not os.path.exists(sixel_path):
+        if not os.path.exists(crop_path):
+            return False
+
+        try:
+            write_file_atomically(sixel_path, converter.SixelConverter(crop_path).getvalue().encode())
+        except (OSError, PIL.UnidentifiedImageError) as e:
+            dbg(f"Could not convert {crop_path} to sixel: {e}")
+            return False
+
+    with open(sixel_path, encoding="utf-8") as file:
+        console.print(Text(file.read(), end=""))
+
+    return True
+
+@typechecked
+def display_sixel_part(image_path: str, location: Union[tuple, list], frame: Optional[DecodedImage] = None) -> None:
+    import PIL.Image
+
     top, right, bottom, left = location
 
     with tempfile.NamedTemporaryFile(mode="wb") as jpg:
         import face_recognition
 
-        image = face_recognition.load_image_file(image_path)
+        if frame is not None:
+            image = frame.rgb
+        else:
+            image = face_recognition.load_image_file(image_path)
         face_image = image[top:bottom, left:right]
         pil_image = PIL.Image.fromarray(face_image)
 
@@ -656,7 +1226,10 @@ def display_sixel_part(image_path: str, location: Union[tuple, list]) -> None:
         display_sixel(jpg.name)
 
 @typechecked
-def display_sixel(image_path: str) -> None:
+def display_sixel(image_path: str, frame: Optional[DecodedImage] = None) -> None:
+    import PIL.Image
+    from sixel import converter
+
     if not supports_sixel():
         console.print(f"[red]Error: This terminal does not support sixel. Cannot display {image_path}[/]")
         return
@@ -664,7 +1237,10 @@ def display_sixel(image_path: str) -> None:
     unique_filename = f"/tmp/{uuid.uuid4().hex}_resized_image.png"
 
     try:
-        resize_image(image_path, unique_filename, args.size)
+        if frame is not None:
+            resize_frame(frame, unique_filename, args.size)
+        else:
+            resize_image(image_path, unique_filename, args.size)
 
         sixel_converter = converter.SixelConverter(unique_filename)
 
@@ -684,30 +1260,125 @@ def display_sixel(image_path: str) -> None:
 @typechecked
 def load_existing_images(conn: sqlite3.Connection) -> dict[Any, Any]:
     cursor = conn.cursor()
-    cursor_execute(cursor, 'SELECT file_path, md5 FROM images UNION ALL SELECT file_path, md5 FROM ocr_results')
+    cursor_execute(cursor, '''SELECT file_paths.file_path, images.digest FROM images JOIN file_paths ON file_paths.id = images.file_id
+                      UNION ALL SELECT file_paths.file_path, ocr_results.digest FROM ocr_results JOIN file_paths ON file_paths.id = ocr_results.file_id''')
     rows = cursor.fetchall()
     cursor.close()
     return {row[0]: row[1] for row in rows}
 
+INDEXED_STAGE_QUERIES: dict[str, str] = {
+    "describe": 'SELECT file_path FROM file_paths WHERE id IN (SELECT file_id FROM image_description)',
+    "yolo": 'SELECT file_path FROM file_paths WHERE id IN (SELECT images.file_id FROM images JOIN detections ON images.id = detections.image_id UNION SELECT file_id FROM empty_images)',
+    "ocr": 'SELECT file_path FROM file_paths WHERE id IN (SELECT file_id FROM ocr_results)',
+    "qrcodes": 'SELECT file_path FROM file_paths WHERE id IN (SELECT file_id FROM no_qrcodes UNION SELECT images.file_id FROM images JOIN qrcodes ON images.id = qrcodes.image_id)',
+    "face_recognition": 'SELECT file_path FROM file_paths WHERE id IN (SELECT file_id FROM no_faces UNION SELECT file_id FROM faces UNION SELECT images.file_id FROM images JOIN image_person_mapping ON images.id = image_person_mapping.image_id)'
+}
+
+# Paths that are already indexed, per stage. Loaded once when indexing starts, so the
+# per-file checks below don't need to ask the database for every single image.
+indexed_stages: Optional[dict[str, set[str]]] = None
+
 @typechecked
-def is_file_in_db(conn: sqlite3.Connection, file_path: str, table_name: str, existing_files: Optional[dict] = None) -> bool:
-    if existing_files and file_path in existing_files:
-        return True
+def get_enabled_image_stages() -> list[str]:
+    stages = []
 
-    cursor = conn.cursor()
-    query = f'SELECT COUNT(*) FROM {table_name} WHERE file_path = ?'
-    cursor_execute(cursor, query, (file_path,))
-    res = cursor.fetchone()[0]
-    cursor.close()
+    if args.describe or do_all:
+        stages.append("describe")
+    if args.yolo or do_all:
+        stages.append("yolo")
+    if args.ocr or do_all:
+        stages.append("ocr")
+    if args.qrcodes or do_all:
+        stages.append("qrcodes")
+    if args.face_recognition or do_all:
+        stages.append("face_recognition")
 
-    return res > 0
+    return stages
 
 @typechecked
-def is_file_in_img_desc_db(conn: sqlite3.Connection, file_path: str) -> bool:
+def get_pending_image_stages(image_paths: list[str]) -> list[str]:
+    # The enabled stages that at least one of these images is still missing
+    return [stage for stage in get_enabled_image_stages() if any(not is_in_indexed_stage(stage, image_path) for image_path in image_paths)]
+
+@typechecked
+def load_indexed_stages(conn: sqlite3.Connection) -> dict[str, set[str]]:
+    stages: dict[str, set[str]] = {}
+
+    cursor = conn.cursor()
+    for stage in get_enabled_image_stages():
+        cursor_execute(cursor, INDEXED_STAGE_QUERIES[stage])
+        stages[stage] = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+
+    return stages
+
+@typechecked
+def is_in_indexed_stage(stage: str, file_path: str) -> Optional[bool]:
+    if indexed_stages is not None and stage in indexed_stages:
+        return file_path in indexed_stages[stage]
+
+    return None
+
+@typechecked
+def forget_indexed_file(file_path: str) -> None:
+    if indexed_stages is not None:
+        for stage_paths in indexed_stages.values():
+            stage_paths.discard(file_path)
+
+@typechecked
+def is_changed_file(file_path: str, existing_files: Optional[dict]) -> bool:
+    try:
+        stat_key = get_stat_key(file_path)
+    except FileNotFoundError:
+        return False
+
+    # The digest the results were computed from. The fingerprint alone can't tell, other
+    # passes (like the documents) refresh it for files that were not checked yet.
+    known_digest: Optional[str] = existing_files.get(file_path) if existing_files else None
+
+    if known_digest is None:
+        # Only in stages that store no digest, so the fingerprint is all there is
+        fingerprint = file_fingerprints.get(file_path)
+        if fingerprint is None or fingerprint[:3] == stat_key:
+            return False
+
+        known_digest = fingerprint[3]
+
+    # Doesn't read the file while its stat tuple matches the fingerprint. Older rows may
+    # use another algorithm than --hash_algorithm, so hash like they were hashed.
+    return get_file_digest(file_path, get_digest_algorithm(known_digest)) != known_digest
+
+@typechecked
+def is_file_in_db(conn: sqlite3.Connection, file_path: str, table_name: str, existing_files: Optional[dict] = None) -> bool:
+    if existing_files and file_path in existing_files:
+        return True
+
+    file_id = find_file_id(conn, file_path)
+    if file_id is None:
+        return False
+
+    cursor = conn.cursor()
+    query = f'SELECT COUNT(*) FROM {table_name} WHERE {get_file_id_column(table_name)} = ?'
+    cursor_execute(cursor, query, (file_id,))
+    res = cursor.fetchone()[0]
+    cursor.close()
+
+    return res > 0
+
+@typechecked
+def is_file_in_img_desc_db(conn: sqlite3.Connection, file_path: str) -> bool:
+    indexed = is_in_indexed_stage("describe", file_path)
+    if indexed is not None:
+        return indexed
+
     return is_file_in_db(conn, file_path, "image_description")
 
 @typechecked
 def is_file_in_ocr_db(conn: sqlite3.Connection, file_path: str) -> bool:
+    indexed = is_in_indexed_stage("ocr", file_path)
+    if indexed is not None:
+        return indexed
+
     return is_file_in_db(conn, file_path, "ocr_results")
 
 @typechecked
@@ -715,42 +1386,258 @@ def is_file_in_yolo_db(conn: sqlite3.Connection, file_path: str, existing_files:
     return is_file_in_db(conn, file_path, "images", existing_files)
 
 @typechecked
-def is_existing_detections_label(conn: sqlite3.Connection, label: str) -> bool:
+def find_label_id(conn: sqlite3.Connection, label: str) -> Optional[int]:
     cursor = conn.cursor()
-    cursor_execute(cursor, 'SELECT label FROM detections WHERE label = ? LIMIT 1', (label,))
+    cursor_execute(cursor, 'SELECT id FROM labels WHERE name = ?', (label,))
     res = cursor.fetchone()  # Gibt entweder eine Zeile oder None zurück
     cursor.close()
 
-    return res is not None
+    return res[0] if res else None
+
+# Label name -> id in the labels table, for the labels this process has written
+label_ids: dict[str, int] = {}
+
+# Path -> id in the files table, and directory -> id in the dirs table
+file_ids: dict[str, int] = {}
+dir_ids: dict[str, int] = {}
 
 @typechecked
-def get_md5(file_path: str) -> str:
-    hash_md5 = hashlib.md5()
+def split_file_path(file_path: str) -> tuple[str, str]:
+    # The root directory is stored as '', so dirs.path || '/' || files.name is always the path
+    directory, name = os.path.split(file_path)
+    return directory.rstrip("/"), name
+
+@typechecked
+def insert_and_get_id(conn: sqlite3.Connection, insert_query: str, select_query: str, params: tuple) -> int:
+    cursor = conn.cursor()
+
+    if is_batching(conn):
+        # The id is needed right away, so this runs inside the open batch transaction
+        cursor_execute(cursor, insert_query, params)
+    else:
+        execute_with_retry(conn, insert_query, params)
+
+    cursor_execute(cursor, select_query, params)
+    row_id = cursor.fetchone()[0]
+    cursor.close()
+
+    return row_id
+
+@typechecked
+def get_file_id(conn: sqlite3.Connection, file_path: str) -> int:
+    # Adds the file to the files table if it isn't there yet
+    if file_path in file_ids:
+        return file_ids[file_path]
+
+    directory, name = split_file_path(file_path)
+
+    if directory not in dir_ids:
+        dir_ids[directory] = insert_and_get_id(conn, 'INSERT OR IGNORE INTO dirs (path) VALUES (?)', 'SELECT id FROM dirs WHERE path = ?', (directory,))
+
+    file_ids[file_path] = insert_and_get_id(conn, 'INSERT OR IGNORE INTO files (dir_id, name) VALUES (?, ?)', 'SELECT id FROM files WHERE dir_id = ? AND name = ?', (dir_ids[directory], name))
+
+    return file_ids[file_path]
+
+@typechecked
+def find_file_id(conn: sqlite3.Connection, file_path: str) -> Optional[int]:
+    # Like get_file_id, but None for files that are not in the database
+    if file_path in file_ids:
+        return file_ids[file_path]
+
+    directory, name = split_file_path(file_path)
+
+    cursor = conn.cursor()
+    cursor_execute(cursor, 'SELECT files.id FROM files JOIN dirs ON dirs.id = files.dir_id WHERE dirs.path = ? AND files.name = ?', (directory, name))
+    row = cursor.fetchone()
+    cursor.close()
+
+    if row is None:
+        return None
+
+    file_ids[file_path] = row[0]
+
+    return row[0]
+
+@typechecked
+def get_file_id_column(table_name: str) -> str:
+    # Every table with file data is keyed by files.id, the rowid of the documents full text index is it
+    return "rowid" if table_name == "documents" else "file_id"
+
+@typechecked
+def forget_file(file_path: str) -> None:
+    # After the file was deleted from the files table. A digest that was computed in this
+    # run and is not saved yet is kept, and adds the file again when it is saved.
+    file_ids.pop(file_path, None)
+
+    with fingerprint_lock:
+        if file_path not in unsaved_fingerprints:
+            file_fingerprints.pop(file_path, None)
+
+# (size, mtime_ns, inode, digest) per path. A digest is only trusted as long as the
+# stat tuple of the file is the same as when it was computed.
+file_fingerprints: dict[str, tuple[int, int, int, str]] = {}
+
+# Paths whose fingerprint was computed in this run and not saved to the database yet
+unsaved_fingerprints: set[str] = set()
+
+# Digests may be computed by the prefetch threads, see start_digest_prefetch
+fingerprint_lock: threading.Lock = threading.Lock()
+digest_executor: Optional[ThreadPoolExecutor] = None
+pending_digests: dict[str, Future] = {}
+
+@typechecked
+def get_stat_key(file_path: str) -> tuple[int, int, int]:
+    stats = os.stat(file_path)
+    return (stats.st_size, stats.st_mtime_ns, stats.st_ino)
+
+@typechecked
+def load_file_fingerprints(conn: sqlite3.Connection) -> None:
+    # Also remembers the ids of all files, so indexing doesn't have to look them up one by one
+    cursor = conn.cursor()
+    cursor_execute(cursor, 'SELECT file_paths.file_path, files.id, files.size, files.mtime_ns, files.inode, files.digest FROM files JOIN file_paths ON file_paths.id = files.id')
+    rows = cursor.fetchall()
+    cursor.close()
+
+    with fingerprint_lock:
+        for row in rows:
+            file_ids[row[0]] = row[1]
+
+            if row[5] is not None:
+                file_fingerprints[row[0]] = (row[2], row[3], row[4], row[5])
+
+@typechecked
+def save_file_fingerprints(conn: sqlite3.Connection) -> None:
+    with fingerprint_lock:
+        fingerprints = {file_path: file_fingerprints[file_path] for file_path in unsaved_fingerprints if file_path in file_fingerprints}
+        unsaved_fingerprints.clear()
+
+    rows = [(*fingerprint, get_file_id(conn, file_path)) for file_path, fingerprint in fingerprints.items()]
+
+    if rows:
+        executemany_with_retry(conn, 'UPDATE files SET size = ?, mtime_ns = ?, inode = ?, digest = ? WHERE id = ?', rows)
+
+@typechecked
+def get_digest_algorithm(digest: str) -> str:
+    if ":" in digest:
+        return digest.split(":", 1)[0]
+
+    return "md5"
+
+@typechecked
+def new_hasher(algorithm: str) -> Any:
+    if algorithm == "xxh3_128":
+        import xxhash
+        return xxhash.xxh3_128()
+
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+
+    return hashlib.new(algorithm)
+
+@typechecked
+def hash_file(file_path: str, algorithm: str) -> str:
+    hasher = new_hasher(algorithm)
+    hashed = False
+
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        if os.fstat(f.fileno()).st_size >= HASH_MMAP_MIN_SIZE:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    hasher.update(mapped)
+                hashed = True
+            except (OSError, ValueError):
+                # Not mappable (e.g. special files), read it the normal way
+                hasher = new_hasher(algorithm)
+
+        if not hashed:
+            buffer = bytearray(HASH_BUFFER_SIZE)
+            view = memoryview(buffer)
+
+            while True:
+                read_bytes = f.readinto(buffer)
+                if not read_bytes:
+                    break
+                hasher.update(view[:read_bytes])
+
+    if algorithm == "md5":
+        return hasher.hexdigest()
+
+    return f"{algorithm}:{hasher.hexdigest()}"
+
+@typechecked
+def compute_file_digest(file_path: str, algorithm: str) -> str:
+    stat_key = get_stat_key(file_path)
+
+    with fingerprint_lock:
+        fingerprint = file_fingerprints.get(file_path)
+
+    if fingerprint is not None and fingerprint[:3] == stat_key and get_digest_algorithm(fingerprint[3]) == algorithm:
+        return fingerprint[3]
+
+    digest = hash_file(file_path, algorithm)
+
+    with fingerprint_lock:
+        file_fingerprints[file_path] = (*stat_key, digest)
+        unsaved_fingerprints.add(file_path)
+
+    return digest
+
+@typechecked
+def get_file_digest(file_path: str, algorithm: Optional[str] = None) -> str:
+    future = pending_digests.pop(file_path, None)
+
+    # Only wait for the prefetch when it already started hashing this file
+    if future is not None and not future.cancel():
+        try:
+            future.result()
+        except (CancelledError, OSError):
+            pass
+
+    return compute_file_digest(file_path, algorithm or args.hash_algorithm)
+
+@typechecked
+def start_digest_prefetch(file_paths: list[str]) -> None:
+    global digest_executor
+
+    if args.hash_threads == 0 or digest_executor is not None:
+        return
+
+    digest_executor = ThreadPoolExecutor(max_workers=args.hash_threads)
+
+    for file_path in file_paths:
+        pending_digests[file_path] = digest_executor.submit(compute_file_digest, file_path, args.hash_algorithm)
+
+@typechecked
+def stop_digest_prefetch() -> None:
+    global digest_executor
+
+    if digest_executor is not None:
+        digest_executor.shutdown(wait=True, cancel_futures=True)
+        digest_executor = None
+
+    pending_digests.clear()
 
 @typechecked
 def add_empty_image(conn: sqlite3.Connection, file_path: str) -> None:
     dbg(f"add_empty_image(conn, {file_path})")
-    md5_hash = get_md5(file_path)
+    file_digest = get_file_digest(file_path)
+    file_id = get_file_id(conn, file_path)
 
     cursor = conn.cursor()
 
     while True:
         try:
-            cursor_execute(cursor, 'SELECT md5 FROM empty_images WHERE file_path = ?', (file_path,))
+            cursor_execute(cursor, 'SELECT digest FROM empty_images WHERE file_id = ?', (file_id,))
             existing_hash = cursor.fetchone()
 
             if existing_hash:
-                if existing_hash[0] != md5_hash:
-                    cursor_execute(cursor, 'UPDATE empty_images SET md5 = ? WHERE file_path = ?', (md5_hash, file_path))
-                    conn.commit()
-                    dbg(f"Updated MD5 hash for {file_path}")
+                if existing_hash[0] != file_digest:
+                    cursor_execute(cursor, 'UPDATE empty_images SET digest = ? WHERE file_id = ?', (file_digest, file_id))
+                    commit_unless_batching(conn)
+                    dbg(f"Updated digest of {file_path}")
             else:
-                cursor_execute(cursor, 'INSERT INTO empty_images (file_path, md5) VALUES (?, ?)', (file_path, md5_hash))
-                conn.commit()
+                cursor_execute(cursor, 'INSERT INTO empty_images (file_id, digest) VALUES (?, ?)', (file_id, file_digest))
+                commit_unless_batching(conn)
                 dbg(f"Added empty image: {file_path}")
             cursor.close()
             return
@@ -769,17 +1656,18 @@ def add_image_persons_mapping(conn: sqlite3.Connection, file_path: str, person_n
 
 @typechecked
 def add_image_and_person_mapping(conn: sqlite3.Connection, file_path: str, person_name: str) -> None:
+    file_id = get_file_id(conn, file_path)
     cursor = conn.cursor()
 
     while True:
         try:
             # 1. Image ID aus der images-Tabelle holen oder einfügen
-            cursor_execute(cursor, 'SELECT id FROM images WHERE file_path = ?', (file_path,))
+            cursor_execute(cursor, 'SELECT id FROM images WHERE file_id = ?', (file_id,))
             image_id = cursor.fetchone()
 
             if not image_id:
-                cursor_execute(cursor, 'INSERT INTO images (file_path) VALUES (?)', (file_path,))
-                conn.commit()
+                cursor_execute(cursor, 'INSERT INTO images (file_id) VALUES (?)', (file_id,))
+                commit_unless_batching(conn)
                 image_id = cursor.lastrowid
             else:
                 image_id = image_id[0]
@@ -789,13 +1677,13 @@ def add_image_and_person_mapping(conn: sqlite3.Connection, file_path: str, perso
 
             if not person_id:
                 cursor_execute(cursor, 'INSERT INTO person (name) VALUES (?)', (person_name,))
-                conn.commit()
+                commit_unless_batching(conn)
                 person_id = cursor.lastrowid
             else:
                 person_id = person_id[0]
 
             cursor_execute(cursor, 'INSERT OR IGNORE INTO image_person_mapping (image_id, person_id) VALUES (?, ?)', (image_id, person_id))
-            conn.commit()
+            commit_unless_batching(conn)
 
             dbg(f"Mapped image '{file_path}' (ID: {image_id}) to person '{person_name}' (ID: {person_id})")
             cursor.close()
@@ -811,24 +1699,203 @@ def add_image_and_person_mapping(conn: sqlite3.Connection, file_path: str, perso
 
 @typechecked
 def insert_into_no_qrcodes(conn: sqlite3.Connection, file_path: str) -> None:
-    execute_with_retry(conn, 'INSERT OR IGNORE INTO no_qrcodes (file_path) VALUES (?)', (file_path, ))
+    execute_with_retry(conn, 'INSERT OR IGNORE INTO no_qrcodes (file_id) VALUES (?)', (get_file_id(conn, file_path), ))
 
 @typechecked
 def insert_into_no_faces(conn: sqlite3.Connection, file_path: str) -> None:
-    execute_with_retry(conn, 'INSERT OR IGNORE INTO no_faces (file_path) VALUES (?)', (file_path, ))
+    execute_with_retry(conn, 'INSERT OR IGNORE INTO no_faces (file_id) VALUES (?)', (get_file_id(conn, file_path), ))
+
+@typechecked
+def store_extracted_faces(conn: sqlite3.Connection, file_path: str, face_encodings: list, face_locations: list, crop_hashes: list) -> None:
+    import numpy
+
+    if len(face_encodings) == 0:
+        insert_into_no_faces(conn, file_path)
+        return
+
+    file_id = get_file_id(conn, file_path)
+
+    # The images row is needed later to map the image to the persons on it
+    execute_with_retry(conn, 'INSERT OR IGNORE INTO images (file_id) VALUES (?)', (file_id,))
+
+    rows = [(file_id, *[int(value) for value in location], numpy.asarray(encoding, dtype=numpy.float32).tobytes(), crop_hash) for encoding, location, crop_hash in zip(face_encodings, face_locations, crop_hashes)]
+
+    # Faces that are already stored keep their row, with the person or ignored flag it got
+    executemany_with_retry(conn, 'INSERT OR IGNORE INTO faces (file_id, bbox_top, bbox_right, bbox_bottom, bbox_left, encoding, crop_hash) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+@typechecked
+def load_unlabelled_faces(conn: sqlite3.Connection, file_paths: Optional[list[str]] = None) -> list[tuple[int, str, tuple, numpy.ndarray, Optional[str]]]:
+    import numpy
+
+    query = '''SELECT faces.id, file_paths.file_path, bbox_top, bbox_right, bbox_bottom, bbox_left, encoding, crop_hash
+               FROM faces JOIN file_paths ON file_paths.id = faces.file_id
+               WHERE person_id IS NULL AND ignored = 0'''
+    params: tuple = ()
+
+    if file_paths is not None:
+        query += ' AND faces.file_id IN (SELECT value FROM json_each(?))'
+        params = (json.dumps([find_file_id(conn, file_path) for file_path in file_paths]),)
+
+    cursor = conn.cursor()
+    cursor_execute(cursor, query, params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    return [(row[0], row[1], (row[2], row[3], row[4], row[5]), numpy.frombuffer(row[6], dtype=numpy.float32), row[7]) for row in rows]
+
+@typechecked
+def get_person_id(conn: sqlite3.Connection, person_name: str) -> int:
+    cursor = conn.cursor()
+
+    while True:
+        try:
+            cursor_execute(cursor, 'INSERT OR IGNORE INTO person (name) VALUES (?)', (person_name,))
+            cursor_execute(cursor, 'SELECT id FROM person WHERE name = ?', (person_name,))
+            person_id = cursor.fetchone()[0]
+            commit_unless_batching(conn)
+            cursor.close()
+            return person_id
+        except sqlite3.OperationalError as e:
+            if "database is locked" in str(e):
+                console.print("[yellow]Database is locked, retrying...[/]")
+                time.sleep(1)
+            else:
+                console.print(f"\n[red]Error: {e}[/]")
+                sys.exit(13)
+
+@typechecked
+def set_person_for_faces(conn: sqlite3.Connection, person_name: str, face_ids: list[int]) -> None:
+    # One statement labels every face, however many images they are in
+    person_id = get_person_id(conn, person_name)
+    ids = json.dumps(face_ids)
+
+    execute_with_retry(conn, 'UPDATE faces SET person_id = ? WHERE id IN (SELECT value FROM json_each(?))', (person_id, ids))
+    execute_with_retry(conn, 'INSERT OR IGNORE INTO image_person_mapping (image_id, person_id) SELECT DISTINCT images.id, ? FROM faces JOIN images ON images.file_id = faces.file_id WHERE faces.id IN (SELECT value FROM json_each(?))', (person_id, ids))
+
+@typechecked
+def ignore_faces(conn: sqlite3.Connection, face_ids: list[int]) -> None:
+    execute_with_retry(conn, 'UPDATE faces SET ignored = 1 WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(face_ids),))
+
+@typechecked
+def get_persons_in_image(conn: sqlite3.Connection, file_path: str) -> list[str]:
+    cursor = conn.cursor()
+    cursor_execute(cursor, 'SELECT DISTINCT person.name FROM faces JOIN person ON person.id = faces.person_id WHERE faces.file_id = ?', (find_file_id(conn, file_path),))
+    rows = cursor.fetchall()
+    cursor.close()
+
+    return [row[0] for row in rows]
+
+@typechecked
+def match_unlabelled_faces(conn: sqlite3.Connection, file_paths: Optional[list[str]] = None) -> None:
+    faces = load_unlabelled_faces(conn, file_paths)
+
+    if not faces:
+        return
+
+    face_ids_by_name: dict[str, list[int]] = {}
+
+    for face, name in zip(faces, get_face_gallery().match([face[3] for face in faces], args.tolerance_face_detection)):
+        if name is not None:
+            face_ids_by_name.setdefault(name, []).append(face[0])
+
+    for name, face_ids in face_ids_by_name.items():
+        console.print(f"[green]Recognized {name} in {len(face_ids)} face(s)[/]")
+        set_person_for_faces(conn, name, face_ids)
+
+@typechecked
+def label_unknown_faces(conn: sqlite3.Connection, progress: Any = None, file_paths: Optional[list[str]] = None) -> bool:
+    import numpy
+
+    # Only reads from the faces table, no image has to be analyzed again. Returns
+    # whether a name was entered.
+    gallery = get_face_gallery()
+
+    match_unlabelled_faces(conn, file_paths)
+
+    if args.dont_ask_new_faces:
+        return False
+
+    faces = load_unlabelled_faces(conn, file_paths)
+
+    if not faces:
+        return False
+
+    if not supports_sixel():
+        console.print(f"[yellow]{len(faces)} face(s) could not be recognized. Cannot ask for their names without a terminal that supports sixel, they will be asked for in the next run in one that does.[/]")
+        return False
+
+    encodings = numpy.array([face[3] for face in faces], dtype=numpy.float32).reshape(-1, FACE_ENCODING_SIZE)
+
+    if args.cluster_unknown_faces:
+        clusters = cluster_face_encodings(encodings, args.tolerance_face_detection)
+        console.print(f"[green]Found {len(faces)} unknown faces in {len(clusters)} groups[/]")
+    else:
+        clusters = [[i] for i in range(len(faces))]
+
+    resolved = numpy.zeros(len(faces), dtype=bool)
+    manually_entered_name = False
+
+    for cluster in clusters:
+        cluster = [i for i in cluster if not resolved[i]]
+
+        if not cluster:
+            continue
+
+        # The face nearest to the middle of the group stands for all of it
+        center = encodings[cluster].mean(axis=0)
+        representative = cluster[int(numpy.argmin(face_distances(encodings[cluster], center[None, :])[0]))]
+
+        # Someone who was named for an earlier face may be this one, too
+        name = gallery.match([encodings[representative]], args.tolerance_face_detection)[0]
+
+        if name is None:
+            _, image_path, location, _, crop_hash = faces[representative]
+            new_id = ask_name_for_face(image_path, location, crop_hash, len({faces[i][1] for i in cluster}), progress)
+
+            if not any(char.strip() for char in new_id):
+                console.print(f"[yellow]Ignoring wrongly detected face in {image_path}[/]")
+                resolved[cluster] = True
+                ignore_faces(conn, [faces[i][0] for i in cluster])
+                continue
+
+            name = new_id
+            gallery.add(name, encodings[representative])
+            manually_entered_name = True
+
+        # Every other unknown face that looks like this one gets the name, too
+        nearby = numpy.flatnonzero((face_distances(encodings, encodings[representative][None, :])[0] <= args.tolerance_face_detection) & ~resolved)
+        labelled = sorted(set(cluster) | set(nearby.tolist()))
+
+        resolved[labelled] = True
+        set_person_for_faces(conn, name, [faces[i][0] for i in labelled])
+
+    return manually_entered_name
 
 @typechecked
 def faces_already_recognized(conn: sqlite3.Connection, image_path: str) -> bool:
+    indexed = is_in_indexed_stage("face_recognition", image_path)
+    if indexed is not None:
+        return indexed
+
+    file_id = find_file_id(conn, image_path)
+    if file_id is None:
+        return False  # Bild wurde noch nicht durchsucht
+
     cursor = conn.cursor()
 
-    cursor_execute(cursor, 'SELECT 1 FROM no_faces WHERE file_path = ?', (image_path,))
+    cursor_execute(cursor, 'SELECT 1 FROM no_faces WHERE file_id = ?', (file_id,))
     if cursor.fetchone():
         cursor.close()
         return True  # Bild befindet sich in der no_faces-Tabelle
 
+    cursor_execute(cursor, 'SELECT 1 FROM faces WHERE file_id = ?', (file_id,))
+    if cursor.fetchone():
+        cursor.close()
+        return True
+
     cursor_execute(cursor, '''SELECT 1 FROM image_person_mapping
                       JOIN images ON images.id = image_person_mapping.image_id
-                      WHERE images.file_path = ?''', (image_path,))
+                      WHERE images.file_id = ?''', (file_id,))
     if cursor.fetchone():
         cursor.close()
         return True  # Bild befindet sich in der image_person_mapping-Tabelle
@@ -839,12 +1906,16 @@ def faces_already_recognized(conn: sqlite3.Connection, image_path: str) -> bool:
 @typechecked
 def get_image_id_by_file_path(conn: sqlite3.Connection, file_path: str) -> Optional[int]:
     try:
+        file_id = find_file_id(conn, file_path)
+        if file_id is None:
+            return None
+
         # SQL query to retrieve the image ID
-        query = 'SELECT id FROM images WHERE file_path = ?'
+        query = 'SELECT id FROM images WHERE file_id = ?'
 
         # Execute the query
         cursor = conn.cursor()
-        cursor_execute(cursor, query, (file_path,))
+        cursor_execute(cursor, query, (file_id,))
         result = cursor.fetchone()
 
         # Check if a result was found
@@ -856,86 +1927,423 @@ def get_image_id_by_file_path(conn: sqlite3.Connection, file_path: str) -> Optio
         return None
 
 @typechecked
-def execute_queries(conn: sqlite3.Connection, queries: list[str], status: Any) -> None:
+def execute_queries(conn: sqlite3.Connection, queries: list[str], status: Any) -> None:
+    cursor = conn.cursor()
+    for query in queries:
+        status_message = "Executing query..."
+
+        if query.startswith("CREATE TABLE"):
+            re_res = re.search(r"CREATE TABLE IF NOT EXISTS (\S+)", query)
+            if re_res:
+                table_name = re_res.group(1)
+                status_message = f"Creating table {table_name}..."
+        elif query.startswith("CREATE INDEX"):
+            re_res = re.search(r"CREATE INDEX IF NOT EXISTS (\S+)", query)
+            if re_res:
+                index_name = re_res.group(1)
+                status_message = f"Creating index {index_name}..."
+        elif query.startswith("CREATE VIRTUAL TABLE"):
+            re_res = re.search(r"CREATE VIRTUAL TABLE IF NOT EXISTS (\S+)", query)
+            if re_res:
+                table_name = re_res.group(1)
+                status_message = f"Creating virtual table {table_name}..."
+        elif query.startswith("CREATE TRIGGER"):
+            re_res = re.search(r"CREATE TRIGGER IF NOT EXISTS (\S+)", query)
+            if re_res:
+                trigger_name = re_res.group(1)
+                status_message = f"Creating trigger {trigger_name}..."
+        elif query.startswith("DROP INDEX"):
+            re_res = re.search(r"DROP INDEX IF EXISTS (\S+)", query)
+            if re_res:
+                index_name = re_res.group(1)
+                status_message = f"Dropping index {index_name}..."
+        elif query.startswith("ALTER TABLE"):
+            re_res = re.search(r"ALTER TABLE (\S+) RENAME COLUMN (\S+) TO (\S+)", query)
+            if re_res:
+                table_name, old_name, new_name = re_res.groups()
+                status_message = f"Renaming column {old_name} of {table_name} to {new_name}..."
+        elif query.startswith("CREATE VIEW"):
+            re_res = re.search(r"CREATE VIEW IF NOT EXISTS (\S+)", query)
+            if re_res:
+                view_name = re_res.group(1)
+                status_message = f"Creating view {view_name}..."
+
+        status_msg = f"[bold green]{status_message}"
+
+        dbg(status_msg)
+        status.update(status_msg)
+        dbg(f"Executing query: {query}")
+        cursor_execute(cursor, query)
+        status.update("[bold green]Executed query.")
+
+    cursor.close()
+    conn.commit()
+
+@typechecked
+def connect_database(db_path: str, read_only: bool = False) -> sqlite3.Connection:
+    dbg(f"connect_database({db_path}, read_only={read_only})")
+
+    if read_only:
+        # A read-only connection never takes a write lock, so searches and a running indexer don't block each other
+        conn = sqlite3.connect(f"{Path(db_path).absolute().as_uri()}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_path)
+
+    for pragma_name, pragma_value in sqlite_pragmas.items():
+        if read_only and pragma_name == "journal_mode":
+            continue
+
+        conn_execute(conn, f"PRAGMA {pragma_name} = {pragma_value}")
+
+    return conn
+
+# Every path is stored once, as a name in a directory. All other tables point to
+# files.id, file_paths puts the full path back together for queries.
+# AUTOINCREMENT, so the id of a deleted file is never handed out again. Rows that were
+# left behind under an old id can't end up belonging to another file.
+FILES_TABLE_COLUMNS: str = 'id INTEGER PRIMARY KEY AUTOINCREMENT, dir_id INTEGER NOT NULL REFERENCES dirs(id), name TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, inode INTEGER, digest TEXT, UNIQUE (dir_id, name)'
+FILE_PATHS_VIEW_QUERY: str = "CREATE VIEW IF NOT EXISTS file_paths AS SELECT files.id AS id, dirs.path AS dir_path, files.name AS name, dirs.path || '/' || files.name AS file_path FROM files JOIN dirs ON dirs.id = files.dir_id"
+
+FILES_TABLE_QUERIES: list[str] = [
+    'CREATE TABLE IF NOT EXISTS dirs (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL)',
+    f'CREATE TABLE IF NOT EXISTS files ({FILES_TABLE_COLUMNS})',
+    FILE_PATHS_VIEW_QUERY
+]
+
+# Columns of the tables that store results per file: table -> column definitions
+FILE_DATA_TABLES: dict[str, str] = {
+    "images": 'id INTEGER PRIMARY KEY, file_id INTEGER UNIQUE REFERENCES files(id), size INTEGER, created_at TEXT, last_modified_at TEXT, digest TEXT',
+    "empty_images": 'file_id INTEGER UNIQUE REFERENCES files(id), digest TEXT',
+    "ocr_results": 'id INTEGER PRIMARY KEY, file_id INTEGER UNIQUE REFERENCES files(id), extracted_text TEXT, digest TEXT',
+    "image_description": 'id INTEGER PRIMARY KEY, file_id INTEGER UNIQUE REFERENCES files(id), image_description TEXT, digest TEXT',
+    "no_faces": 'id INTEGER PRIMARY KEY, file_id INTEGER UNIQUE NOT NULL REFERENCES files(id)',
+    "no_qrcodes": 'id INTEGER PRIMARY KEY, file_id INTEGER UNIQUE NOT NULL REFERENCES files(id)',
+    "file_types": 'file_id INTEGER UNIQUE NOT NULL REFERENCES files(id), general_type TEXT NOT NULL, specific_type TEXT NOT NULL, digest TEXT NOT NULL',
+    "faces": 'id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL REFERENCES files(id), bbox_top INTEGER NOT NULL, bbox_right INTEGER NOT NULL, bbox_bottom INTEGER NOT NULL, bbox_left INTEGER NOT NULL, encoding BLOB NOT NULL, person_id INTEGER, ignored INTEGER NOT NULL DEFAULT 0, crop_hash TEXT, FOREIGN KEY (person_id) REFERENCES person(id) ON DELETE SET NULL'
+}
+
+# A face is stored once per place in an image, so analyzing an image again doesn't add it twice
+FACES_UNIQUE_INDEX_QUERY: str = 'CREATE UNIQUE INDEX IF NOT EXISTS idx_faces_file_id_bbox ON faces(file_id, bbox_top, bbox_right, bbox_bottom, bbox_left)'
+
+# The text of a document is stored with the id of its file as rowid
+DOCUMENTS_TABLE_QUERY: str = 'CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(content, tokenize = "porter")'
+
+# FTS5 indexes over text columns of normal tables: fts table -> (content table, column).
+# The content stays in the normal table, triggers keep the index in sync with it.
+FTS_CONTENT_TABLES: dict[str, tuple[str, str]] = {
+    "ocr_results_fts": ("ocr_results", "extracted_text"),
+    "image_description_fts": ("image_description", "image_description")
+}
+
+@typechecked
+def get_fts_content_table_queries(fts_table: str, content_table: str, column: str) -> list[str]:
+    delete_old = f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column});"
+    insert_new = f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.id, new.{column});"
+
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({column}, content = '{content_table}', content_rowid = 'id', tokenize = \"porter\")",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {content_table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {content_table} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE ON {content_table} BEGIN {delete_old} {insert_new} END"
+    ]
+
+@typechecked
+def get_existing_tables(conn: sqlite3.Connection) -> set[str]:
+    cursor = conn.cursor()
+    cursor_execute(cursor, "SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+
+    return tables
+
+@typechecked
+def backfill_fts_tables(conn: sqlite3.Connection, fts_tables: list[str], status: Any) -> None:
+    # Rows that were there before the index existed. Only needed once, the triggers
+    # take care of everything after that.
+    cursor = conn.cursor()
+
+    for fts_table in fts_tables:
+        status.update(f"[bold green]Building full text index {fts_table}...")
+        cursor_execute(cursor, f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+    cursor.close()
+    conn.commit()
+
+@typechecked
+def get_table_columns(conn: sqlite3.Connection, table_name: str) -> list[str]:
+    # Empty for tables that don't exist
+    cursor = conn.cursor()
+    cursor_execute(cursor, f'PRAGMA table_info({table_name})')
+    columns = [row[1] for row in cursor.fetchall()]
+    cursor.close()
+
+    return columns
+
+@typechecked
+def add_missing_columns(conn: sqlite3.Connection, table_name: str, columns: dict[str, str]) -> list[str]:
+    # For tables that got new columns after they were first created. Returns the added columns.
+    existing_columns = get_table_columns(conn, table_name)
+    cursor = conn.cursor()
+    added_columns = []
+
+    for column_name, column_type in columns.items():
+        if column_name not in existing_columns:
+            dbg(f"Adding column {column_name} to {table_name}")
+            cursor_execute(cursor, f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}')
+            added_columns.append(column_name)
+
+    conn.commit()
+    cursor.close()
+
+    return added_columns
+
+@typechecked
+def backfill_detection_label_ids(conn: sqlite3.Connection, status: Any) -> None:
+    # Detections from before the labels table only have the label as text
+    status.update("[bold green]Moving YOLO labels to the labels table...")
+
+    cursor = conn.cursor()
+    cursor_execute(cursor, 'INSERT OR IGNORE INTO labels (name) SELECT DISTINCT label FROM detections WHERE label_id IS NULL AND label IS NOT NULL')
+    cursor_execute(cursor, 'UPDATE detections SET label_id = (SELECT id FROM labels WHERE labels.name = detections.label) WHERE label_id IS NULL AND label IS NOT NULL')
+    cursor.close()
+    conn.commit()
+
+# Columns of FILE_DATA_TABLES that older versions named differently: old name -> new name
+RENAMED_COLUMNS: dict[str, str] = {
+    "md5": "digest"
+}
+
+@typechecked
+def migrate_file_paths_to_files(conn: sqlite3.Connection, status: Any) -> None:
+    # Older databases had the full path as text key in every table. Moves those paths
+    # to files/dirs and rebuilds the tables keyed by file id, all in one transaction.
+    cursor = conn.cursor()
+
+    try:
+        # Takes the write lock before looking, so a second process waits and then finds nothing to do
+        cursor_execute(cursor, "BEGIN IMMEDIATE")
+
+        legacy_tables = [table_name for table_name in [*FILE_DATA_TABLES, "documents", "file_fingerprints"] if "file_path" in get_table_columns(conn, table_name)]
+        if not legacy_tables:
+            conn.commit()
+            return
+
+        status.update("[bold green]Moving file paths to the files table...")
+
+        for query in FILES_TABLE_QUERIES:
+            cursor_execute(cursor, query)
+
+        file_paths: set[str] = set()
+        for table_name in legacy_tables:
+            cursor_execute(cursor, f'SELECT DISTINCT file_path FROM {table_name} WHERE file_path IS NOT NULL')
+            file_paths.update(row[0] for row in cursor.fetchall())
+
+        split_paths = [split_file_path(file_path) for file_path in file_paths]
+
+        cursor.executemany('INSERT OR IGNORE INTO dirs (path) VALUES (?)', [(directory,) for directory in {directory for directory, _ in split_paths}])
+        cursor_execute(cursor, 'SELECT path, id FROM dirs')
+        migrated_dir_ids = dict(cursor.fetchall())
+        cursor.executemany('INSERT OR IGNORE INTO files (dir_id, name) VALUES (?, ?)', [(migrated_dir_ids[directory], name) for directory, name in split_paths])
+
+        cursor_execute(cursor, 'CREATE TEMP TABLE legacy_file_ids (file_path TEXT PRIMARY KEY, file_id INTEGER NOT NULL)')
+        cursor_execute(cursor, 'INSERT INTO temp.legacy_file_ids SELECT file_path, id FROM file_paths')
+
+        for table_name in legacy_tables:
+            status.update(f"[bold green]Moving {table_name} to the files table...")
+
+            if table_name == "file_fingerprints":
+                cursor_execute(cursor, '''UPDATE files SET (size, mtime_ns, inode, digest) = (
+                                      SELECT size, mtime_ns, inode, digest FROM file_fingerprints JOIN temp.legacy_file_ids USING (file_path) WHERE legacy_file_ids.file_id = files.id)
+                                  WHERE id IN (SELECT legacy_file_ids.file_id FROM file_fingerprints JOIN temp.legacy_file_ids USING (file_path))''')
+                cursor_execute(cursor, 'DROP TABLE file_fingerprints')
+                continue
+
+            if table_name == "documents":
+                cursor_execute(cursor, DOCUMENTS_TABLE_QUERY.replace("documents", "documents_migrated", 1))
+                cursor_execute(cursor, 'INSERT INTO documents_migrated (rowid, content) SELECT legacy_file_ids.file_id, documents.content FROM documents JOIN temp.legacy_file_ids USING (file_path) GROUP BY legacy_file_ids.file_id')
+            else:
+                cursor_execute(cursor, f'CREATE TABLE {table_name}_migrated ({FILE_DATA_TABLES[table_name]})')
+                new_columns = get_table_columns(conn, f"{table_name}_migrated")
+                columns = [column for column in get_table_columns(conn, table_name) if column != "file_path" and RENAMED_COLUMNS.get(column, column) in new_columns]
+                column_list = "".join(f", {RENAMED_COLUMNS.get(column, column)}" for column in columns)
+                selected_columns = "".join(f", {table_name}.{column}" for column in columns)
+                cursor_execute(cursor, f'INSERT OR IGNORE INTO {table_name}_migrated (file_id{column_list}) SELECT legacy_file_ids.file_id{selected_columns} FROM {table_name} JOIN temp.legacy_file_ids USING (file_path)')
+
+            cursor_execute(cursor, f'DROP TABLE {table_name}')
+            cursor_execute(cursor, f'ALTER TABLE {table_name}_migrated RENAME TO {table_name}')
+
+        cursor_execute(cursor, 'DROP TABLE temp.legacy_file_ids')
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    console.print(f"[green]Moved {len(file_paths)} file paths to the files table. Run smartlocate --vacuum to give the space they used back to the file system.[/]")
+
+@typechecked
+def create_schema(conn: sqlite3.Connection, status: Any) -> None:
+    # Also brings databases from before the schema version up to date, so everything is IF NOT EXISTS
+    existing_tables = get_existing_tables(conn)
+
+    queries = [
+        *FILES_TABLE_QUERIES,
+        *[f'CREATE TABLE IF NOT EXISTS {table_name} ({columns})' for table_name, columns in FILE_DATA_TABLES.items()],
+        'CREATE TABLE IF NOT EXISTS labels (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS detections (id INTEGER PRIMARY KEY, image_id INTEGER, model TEXT, label TEXT, confidence REAL, label_id INTEGER REFERENCES labels(id), FOREIGN KEY(image_id) REFERENCES images(id) ON DELETE CASCADE)',
+        'CREATE TABLE IF NOT EXISTS person (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS image_person_mapping (image_id INTEGER NOT NULL, person_id INTEGER NOT NULL, PRIMARY KEY (image_id, person_id), FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE, FOREIGN KEY (person_id) REFERENCES person(id) ON DELETE CASCADE)',
+        'CREATE TABLE IF NOT EXISTS qrcodes (image_id INTEGER NOT NULL, content, FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE)',
+
+        DOCUMENTS_TABLE_QUERY,
+
+        'CREATE INDEX IF NOT EXISTS idx_detections_image_model ON detections(image_id, model)',
+        FACES_UNIQUE_INDEX_QUERY,
+        'CREATE INDEX IF NOT EXISTS idx_faces_person_id ON faces(person_id)'
+    ]
+
+    for fts_table, (content_table, column) in FTS_CONTENT_TABLES.items():
+        queries.extend(get_fts_content_table_queries(fts_table, content_table, column))
+
+    execute_queries(conn, queries, status)
+
+    add_missing_columns(conn, "faces", {"crop_hash": "TEXT"})
+
+    if add_missing_columns(conn, "detections", {"label_id": "INTEGER REFERENCES labels(id)"}):
+        backfill_detection_label_ids(conn, status)
+
+    # Needs the label_id column, which older databases only have from here on
+    execute_queries(conn, ['CREATE INDEX IF NOT EXISTS idx_detections_label_id_confidence ON detections(label_id, confidence)'], status)
+
+    backfill_fts_tables(conn, [fts_table for fts_table in FTS_CONTENT_TABLES if fts_table not in existing_tables], status)
+
+# Created by older versions. idx_detections_image_model already covers image_id, and
+# labels, md5s and descriptions are looked up through label_id and the full text indexes.
+REDUNDANT_INDEXES: list[str] = [
+    "idx_detections_image_id",
+    "idx_detections_label",
+    "idx_detections_label_image_id",
+    "idx_image_description_no_case",
+    "idx_images_md5",
+    "idx_ocr_results_md5"
+]
+
+@typechecked
+def drop_redundant_indexes(conn: sqlite3.Connection, status: Any) -> None:
+    execute_queries(conn, [f'DROP INDEX IF EXISTS {index_name}' for index_name in REDUNDANT_INDEXES], status)
+
+@typechecked
+def use_autoincrement_file_ids(conn: sqlite3.Connection, status: Any) -> None:
+    # files.id used to be a plain INTEGER PRIMARY KEY, which reuses the highest id after a delete
     cursor = conn.cursor()
-    for query in queries:
-        status_message = "Executing query..."
 
-        if query.startswith("CREATE TABLE"):
-            re_res = re.search(r"CREATE TABLE IF NOT EXISTS (\S+)", query)
-            if re_res:
-                table_name = re_res.group(1)
-                status_message = f"Creating table {table_name}..."
-        elif query.startswith("CREATE INDEX"):
-            re_res = re.search(r"CREATE INDEX IF NOT EXISTS (\S+)", query)
-            if re_res:
-                index_name = re_res.group(1)
-                status_message = f"Creating index {index_name}..."
-        elif query.startswith("CREATE VIRTUAL TABLE"):
-            re_res = re.search(r"CREATE VIRTUAL TABLE IF NOT EXISTS (\S+)", query)
-            if re_res:
-                table_name = re_res.group(1)
-                status_message = f"Creating virtual table {table_name}..."
+    try:
+        cursor_execute(cursor, "BEGIN IMMEDIATE")
 
-        status_msg = f"[bold green]{status_message}"
+        cursor_execute(cursor, "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'files'")
+        row = cursor.fetchone()
+        if row is None or "AUTOINCREMENT" in row[0].upper():
+            conn.commit()
+            return
 
-        dbg(status_msg)
-        status.update(status_msg)
-        dbg(f"Executing query: {query}")
-        cursor_execute(cursor, query)
-        status.update("[bold green]Executed query.")
+        status.update("[bold green]Rebuilding the files table...")
+
+        columns = "id, dir_id, name, size, mtime_ns, inode, digest"
+
+        # The view has to go first, renaming a table checks every view that uses it
+        cursor_execute(cursor, 'DROP VIEW IF EXISTS file_paths')
+        cursor_execute(cursor, f'CREATE TABLE files_migrated ({FILES_TABLE_COLUMNS})')
+        cursor_execute(cursor, f'INSERT INTO files_migrated ({columns}) SELECT {columns} FROM files')
+        cursor_execute(cursor, 'DROP TABLE files')
+        cursor_execute(cursor, 'ALTER TABLE files_migrated RENAME TO files')
+        cursor_execute(cursor, FILE_PATHS_VIEW_QUERY)
+
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+@typechecked
+def deduplicate_faces(conn: sqlite3.Connection, status: Any) -> None:
+    # Opening an image again used to store its faces again. Of every copy, the labelled
+    # or ignored one is kept, since that's the one that was already asked for.
+    status.update("[bold green]Removing duplicate faces...")
+
+    execute_queries(conn, [
+        '''DELETE FROM faces WHERE id IN (
+               SELECT id FROM (
+                   SELECT id, ROW_NUMBER() OVER (PARTITION BY file_id, bbox_top, bbox_right, bbox_bottom, bbox_left ORDER BY person_id IS NULL, ignored = 0, id) AS copy_nr FROM faces
+               ) WHERE copy_nr > 1
+           )''',
+        FACES_UNIQUE_INDEX_QUERY,
+        'DROP INDEX IF EXISTS idx_faces_file_id'
+    ], status)
+
+@typechecked
+def rename_digest_columns(conn: sqlite3.Connection, status: Any) -> None:
+    # The digest columns were called md5, but hold digests of any --hash_algorithm
+    queries = []
+
+    for table_name in FILE_DATA_TABLES:
+        columns = get_table_columns(conn, table_name)
+        for old_name, new_name in RENAMED_COLUMNS.items():
+            if old_name in columns and new_name not in columns:
+                queries.append(f'ALTER TABLE {table_name} RENAME COLUMN {old_name} TO {new_name}')
+
+    execute_queries(conn, queries, status)
+
+# Migration n brings a database from schema version n - 1 (PRAGMA user_version) to n.
+# Each one runs only once per database, so only ever append to this list.
+SCHEMA_MIGRATIONS: list[Callable[[sqlite3.Connection, Any], None]] = [
+    migrate_file_paths_to_files,
+    create_schema,
+    drop_redundant_indexes,
+    use_autoincrement_file_ids,
+    deduplicate_faces,
+    rename_digest_columns
+]
 
+@typechecked
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    cursor = conn.cursor()
+    cursor_execute(cursor, 'PRAGMA user_version')
+    schema_version = cursor.fetchone()[0]
     cursor.close()
-    conn.commit()
+
+    return schema_version
 
 @typechecked
 def init_database(db_path: str) -> sqlite3.Connection:
-    with console.status("[bold green]Initializing database...") as status:
-        dbg(f"init_database({db_path})")
-        conn = sqlite3.connect(db_path)
+    dbg(f"init_database({db_path})")
+    conn = connect_database(db_path)
 
-        queries = [
-            'CREATE TABLE IF NOT EXISTS images (id INTEGER PRIMARY KEY, file_path TEXT UNIQUE, size INTEGER, created_at TEXT, last_modified_at TEXT, md5 TEXT)',
-            'CREATE TABLE IF NOT EXISTS detections (id INTEGER PRIMARY KEY, image_id INTEGER, model TEXT, label TEXT, confidence REAL, FOREIGN KEY(image_id) REFERENCES images(id) ON DELETE CASCADE)',
-            'CREATE TABLE IF NOT EXISTS empty_images (file_path TEXT UNIQUE, md5 TEXT)',
-            'CREATE TABLE IF NOT EXISTS ocr_results (id INTEGER PRIMARY KEY, file_path TEXT UNIQUE, extracted_text TEXT, md5 TEXT)',
-            'CREATE TABLE IF NOT EXISTS image_description (id INTEGER PRIMARY KEY, file_path TEXT UNIQUE, image_description TEXT, md5 TEXT)',
-            'CREATE TABLE IF NOT EXISTS person (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)',
-            'CREATE TABLE IF NOT EXISTS image_person_mapping (image_id INTEGER NOT NULL, person_id INTEGER NOT NULL, PRIMARY KEY (image_id, person_id), FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE, FOREIGN KEY (person_id) REFERENCES person(id) ON DELETE CASCADE)',
-            'CREATE TABLE IF NOT EXISTS no_faces (id INTEGER PRIMARY KEY, file_path TEXT UNIQUE NOT NULL)',
-            'CREATE TABLE IF NOT EXISTS no_qrcodes(id INTEGER PRIMARY KEY, file_path TEXT UNIQUE NOT NULL)',
-            'CREATE TABLE IF NOT EXISTS qrcodes (image_id INTEGER NOT NULL, content, FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE)',
-            'CREATE TABLE IF NOT EXISTS file_types (file_path TEXT UNIQUE NOT NULL, general_type TEXT NOT NULL, specific_type TEXT NOT NULL, md5 TEXT NOT NULL)',
-
-            'CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(file_path, content, tokenize = "porter")',
-
-            'CREATE INDEX IF NOT EXISTS idx_detections_image_id ON detections(image_id)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_image_id ON detections(confidence)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_image_model ON detections(image_id, model)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_label ON detections(label)',
-            'CREATE INDEX IF NOT EXISTS idx_images_file_path ON images(file_path)',
-            'CREATE INDEX IF NOT EXISTS idx_images_md5 ON images(md5)',
-            'CREATE INDEX IF NOT EXISTS idx_ocr_results_file_path ON ocr_results(file_path)',
-            'CREATE INDEX IF NOT EXISTS idx_ocr_results_md5 ON ocr_results(md5)',
-            'CREATE INDEX IF NOT EXISTS idx_empty_images_file_path ON empty_images(file_path)',
-            'CREATE INDEX IF NOT EXISTS idx_image_description_file_path ON image_description(file_path)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_label ON detections(label)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_image_id ON detections(image_id)',
-            'CREATE INDEX IF NOT EXISTS idx_images_file_path ON images(file_path)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_label_image_id ON detections(label, image_id)',
-            'CREATE INDEX IF NOT EXISTS idx_image_description_no_case ON image_description(image_description COLLATE NOCASE)',
-            'CREATE INDEX IF NOT EXISTS idx_detections_label ON detections(label)'
-        ]
-
-        execute_queries(conn, queries, status)
+    schema_version = get_schema_version(conn)
 
+    if schema_version >= len(SCHEMA_MIGRATIONS):
         return conn
 
+    with console.status("[bold green]Initializing database...") as status:
+        for version, migration in enumerate(SCHEMA_MIGRATIONS[schema_version:], start=schema_version + 1):
+            dbg(f"Applying schema migration {version}: {migration.__name__}")
+            migration(conn, status)
+
+            conn_execute(conn, f'PRAGMA user_version = {version}')
+            conn.commit()
+
+    return conn
+
 @typechecked
 def document_already_exists(conn: sqlite3.Connection, file_path: str) -> bool:
+    file_id = find_file_id(conn, file_path)
+    if file_id is None:
+        return False
+
     cursor = conn.cursor()
 
-    cursor_execute(cursor, 'SELECT 1 FROM documents WHERE file_path = ?', (file_path,))
+    cursor_execute(cursor, 'SELECT 1 FROM documents WHERE rowid = ?', (file_id,))
     if cursor.fetchone():
         cursor.close()
         return True
@@ -998,7 +2406,12 @@ def insert_document_if_not_exists(conn: sqlite3.Connection, file_path: str, _pan
 
 @typechecked
 def insert_document(conn: sqlite3.Connection, file_path: str, document: str) -> None:
-    execute_with_retry(conn, 'INSERT INTO documents (file_path, content) VALUES (?, ?);', (file_path, document, ))
+    execute_with_retry(conn, 'INSERT INTO documents (rowid, content) VALUES (?, ?);', (get_file_id(conn, file_path), document, ))
+
+@typechecked
+def chunk_list(items: list, chunk_size: int) -> Generator:
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
 
 @typechecked
 def get_extension(path: str) -> str:
@@ -1019,6 +2432,8 @@ def traverse_document_files(conn: sqlite3.Connection, directory_path: str) -> bo
             for file_name in files:
                 file_path = os.path.join(root, file_name)
 
+                maybe_flush_writes(conn)
+
                 add_file_type(conn, file_path)
 
                 # Check if file has an allowed extension
@@ -1051,8 +2466,110 @@ def traverse_document_files(conn: sqlite3.Connection, directory_path: str) -> bo
 
     return found_and_converted_some
 
+class WriteBatcher:
+    # Buffers inserts while indexing and writes them with executemany in one
+    # transaction. Statements that have to run immediately (like inserting an
+    # image to get its id) run inside the same open transaction, so everything
+    # an image wrote becomes visible at the same commit.
+    def __init__(self, conn: sqlite3.Connection, max_rows: int, max_seconds: float) -> None:
+        self.conn = conn
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self._pending: dict[str, list[tuple]] = {}
+        self._nr_rows = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, query: str, rows: list[tuple]) -> None:
+        self._pending.setdefault(query, []).extend(rows)
+        self._nr_rows += len(rows)
+
+    def maybe_flush(self) -> None:
+        # Only call this between two images, never while an image is half written
+        if self._nr_rows >= self.max_rows or time.monotonic() - self._last_flush >= self.max_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        cursor = self.conn.cursor()
+
+        if not self.conn.in_transaction:
+            # Without an open transaction, releasing the savepoint would commit every query on its own
+            cursor.execute("BEGIN")
+
+        for query, rows in self._pending.items():
+            self._executemany(cursor, query, rows)
+
+        cursor.close()
+
+        while True:
+            try:
+                self.conn.commit()
+                break
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e):
+                    console.print("[yellow]Database is locked, retrying...[/]")
+                    time.sleep(1)
+                else:
+                    raise e
+
+        dbg(f"WriteBatcher: committed {self._nr_rows} buffered rows")
+
+        self._pending = {}
+        self._nr_rows = 0
+        self._last_flush = time.monotonic()
+
+    def discard(self) -> None:
+        dbg(f"WriteBatcher: discarding {self._nr_rows} buffered rows")
+
+        self._pending = {}
+        self._nr_rows = 0
+        self.conn.rollback()
+
+    def _executemany(self, cursor: sqlite3.Cursor, query: str, rows: list[tuple]) -> None:
+        dbg(f"{query} ({len(rows)} rows)")
+
+        while True:
+            try:
+                cursor.execute("SAVEPOINT write_batch")
+                cursor.executemany(query, rows)
+                cursor.execute("RELEASE write_batch")
+                return
+            except sqlite3.IntegrityError:
+                cursor.execute("ROLLBACK TO write_batch")
+                cursor.execute("RELEASE write_batch")
+                break
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e):
+                    cursor.execute("ROLLBACK TO write_batch")
+                    cursor.execute("RELEASE write_batch")
+                    console.print("[yellow]Database is locked, retrying...[/]")
+                    time.sleep(1)
+                else:
+                    raise e
+
+        # One of the rows violated a constraint, insert them one by one to keep the others
+        for row in rows:
+            try:
+                cursor.execute(query, row)
+            except sqlite3.IntegrityError as e:
+                console.print(f"[yellow]Skipping a row of '{' '.join(query.split())}': {e}[/]")
+
+write_batcher: Optional[WriteBatcher] = None
+
+@typechecked
+def is_batching(conn: sqlite3.Connection) -> bool:
+    return write_batcher is not None and write_batcher.conn is conn
+
+@typechecked
+def commit_unless_batching(conn: sqlite3.Connection) -> None:
+    if not is_batching(conn):
+        conn.commit()
+
 @typechecked
 def execute_with_retry(conn: sqlite3.Connection, query: str, params: tuple) -> None:
+    if write_batcher is not None and is_batching(conn):
+        write_batcher.add(query, [params])
+        return
+
     cursor = conn.cursor()
 
     while True:
@@ -1078,18 +2595,51 @@ def execute_with_retry(conn: sqlite3.Connection, query: str, params: tuple) -> N
             else:
                 raise e
 
+@typechecked
+def executemany_with_retry(conn: sqlite3.Connection, query: str, rows: list[tuple]) -> None:
+    if not rows:
+        return
+
+    if write_batcher is not None and is_batching(conn):
+        write_batcher.add(query, rows)
+        return
+
+    while True:
+        try:
+            dbg(f"{query} ({len(rows)} rows)")
+            with conn:
+                conn.executemany(query, rows)
+            break
+        except sqlite3.OperationalError as e:
+            if "database is locked" in str(e):
+                console.print("[yellow]Database is locked, retrying...[/]")
+                time.sleep(1)
+            else:
+                raise e
+
 @typechecked
 def add_image_metadata(conn: sqlite3.Connection, file_path: str) -> int:
     dbg(f"add_image_metadata(conn, {file_path})")
     cursor = conn.cursor()
     stats = os.stat(file_path)
-    md5_hash = get_md5(file_path)
+    file_digest = get_file_digest(file_path)
     created_at = datetime.fromtimestamp(stats.st_ctime).isoformat()
     last_modified_at = datetime.fromtimestamp(stats.st_mtime).isoformat()
 
-    execute_with_retry(conn, 'INSERT OR IGNORE INTO images (file_path, size, created_at, last_modified_at, md5) VALUES (?, ?, ?, ?, ?)', (file_path, stats.st_size, created_at, last_modified_at, md5_hash))
+    file_id = get_file_id(conn, file_path)
+
+    # Face recognition runs first and may already have created a bare row for the image
+    query = '''INSERT INTO images (file_id, size, created_at, last_modified_at, digest) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(file_id) DO UPDATE SET size = excluded.size, created_at = excluded.created_at, last_modified_at = excluded.last_modified_at, digest = excluded.digest'''
+    params = (file_id, stats.st_size, created_at, last_modified_at, file_digest)
+
+    if is_batching(conn):
+        # The id is needed right away, so this runs inside the open batch transaction
+        cursor_execute(cursor, query, params)
+    else:
+        execute_with_retry(conn, query, params)
 
-    cursor_execute(cursor, 'SELECT id FROM images WHERE file_path = ?', (file_path,))
+    cursor_execute(cursor, 'SELECT id FROM images WHERE file_id = ?', (file_id,))
     image_id = cursor.fetchone()[0]
 
     return image_id
@@ -1106,10 +2656,10 @@ def is_image_indexed(conn: sqlite3.Connection, file_path: str) -> bool:
 
             cursor_execute(cursor, '''SELECT COUNT(*) FROM images
                    JOIN detections ON images.id = detections.image_id
-                   WHERE images.file_path = ?
+                   WHERE images.file_id = ?
                    AND detections.model = ?
                    AND images.last_modified_at = ?''',
-               (file_path, args.yolo_model, last_modified_at))
+               (find_file_id(conn, file_path), args.yolo_model, last_modified_at))
 
             res = cursor.fetchone()[0]
             cursor.close()
@@ -1127,40 +2677,98 @@ def is_image_indexed(conn: sqlite3.Connection, file_path: str) -> bool:
 
     return False
 
+@typechecked
+def get_label_id(conn: sqlite3.Connection, label: str) -> int:
+    if label not in label_ids:
+        label_ids[label] = insert_and_get_id(conn, 'INSERT OR IGNORE INTO labels (name) VALUES (?)', 'SELECT id FROM labels WHERE name = ?', (label,))
+
+    return label_ids[label]
+
 @typechecked
 def add_detections(conn: sqlite3.Connection, image_id: int, model_name: str, detections: list) -> None:
     dbg(f"add_detections(conn, {image_id}, detections)")
-    for label, confidence in detections:
-        execute_with_retry(conn, 'INSERT INTO detections (image_id, model, label, confidence) VALUES (?, ?, ?, ?)', (image_id, model_name, label, confidence))
+    rows = [(image_id, model_name, get_label_id(conn, label), confidence) for label, confidence in detections]
+    executemany_with_retry(conn, 'INSERT INTO detections (image_id, model, label_id, confidence) VALUES (?, ?, ?, ?)', rows)
 
 @typechecked
 def is_ignored_path(path: str) -> bool:
-    if args.exclude:
-        for excl in args.exclude:
-            if path.startswith(to_absolute_path(excl)):
-                return True
+    for excl in excluded_paths:
+        if path.startswith(excl):
+            return True
 
     return False
 
 @typechecked
-def find_images(existing_files: dict) -> Generator:
+def find_images(indexed: dict[str, set[str]], existing_files: Optional[dict]) -> Generator:
+    # Yields (path, changed) for every image that is missing from at least one enabled
+    # stage, or that was modified since it was indexed in any of them
+    done: set[str] = set.intersection(*indexed.values()) if indexed else set()
+    known: set[str] = set.union(*indexed.values()) if indexed else set()
+
     for root, _, files in os.walk(args.dir):
         for file in files:
-            if Path(file).suffix.lower() in supported_image_formats and file not in existing_files:
+            if Path(file).suffix.lower() in supported_image_formats:
                 _path = os.path.join(root, file)
-                if not is_ignored_path(_path):
-                    yield _path
+                if is_ignored_path(_path):
+                    continue
+
+                if _path in known and is_changed_file(_path, existing_files):
+                    yield _path, True
+                elif _path not in done:
+                    yield _path, False
+
+@typechecked
+def predictions_to_detections(model: Any, predictions: Any) -> list:
+    return [(model.names[int(pred[5])], float(pred[4])) for pred in predictions if float(pred[4]) >= args.yolo_min_confidence_for_saving]
+
+@typechecked
+def analyze_images(model: Any, frames: list[DecodedImage]) -> dict[str, Optional[list]]:
+    import PIL.Image
+
+    results: dict[str, Optional[list]] = {}
+
+    loaded_frames = []
+
+    for frame in frames:
+        try:
+            if frame.pil is not None:
+                loaded_frames.append(frame)
+        except PIL.Image.DecompressionBombError as e:
+            console.print(f"[red]Error while analyzing image {frame.image_path}: {e}, probably the image is too large[/]")
+            results[frame.image_path] = None
+        except (PIL.UnidentifiedImageError, OSError, ValueError) as e:
+            console.print(f"[red]Error while analyzing image {frame.image_path}: {e}[/]")
+            results[frame.image_path] = None
+
+    for batch in chunk_list(loaded_frames, args.yolo_batch_size):
+        try:
+            console.print(f"[bright_yellow]Predicting {len(batch)} images with YOLO in one batch[/]")
+
+            batch_results = model([frame.pil for frame in batch])
+
+            for frame, predictions in zip(batch, batch_results.pred):
+                results[frame.image_path] = predictions_to_detections(model, predictions)
+        except Exception as e:
+            console.print(f"[yellow]Batched YOLO prediction failed ({e}), predicting images one by one[/]")
+
+            for frame in batch:
+                results[frame.image_path] = analyze_image(model, frame.image_path, frame)
+
+    return results
 
 @typechecked
-def analyze_image(model: Any, image_path: str) -> Optional[list]:
+def analyze_image(model: Any, image_path: str, frame: Optional[DecodedImage] = None) -> Optional[list]:
+    import PIL.Image
+
     dbg(f"analyze_image(model, {image_path})")
     try:
         console.print(f"[bright_yellow]Predicting {image_path} with YOLO[/]")
 
-        results = model(image_path)
-        predictions = results.pred[0]
-        detections = [(model.names[int(pred[5])], float(pred[4])) for pred in predictions if float(pred[4]) >= args.yolo_min_confidence_for_saving]
-        return detections
+        if frame is not None:
+            results = model(frame.pil)
+        else:
+            results = model(image_path)
+        return predictions_to_detections(model, results.pred[0])
     except RuntimeError:
         return None
     except ValueError as e:
@@ -1179,12 +2787,15 @@ def analyze_image(model: Any, image_path: str) -> Optional[list]:
         return None
 
 @typechecked
-def process_image(image_path: str, model: Any, conn: sqlite3.Connection) -> None:
+def process_image(image_path: str, model: Any, conn: sqlite3.Connection, frame: Optional[DecodedImage] = None, precomputed: Optional[dict] = None) -> None:
     dbg(f"process_image({image_path}, model, conn)")
 
     image_id = add_image_metadata(conn, image_path)
 
-    detections = analyze_image(model, image_path)
+    if precomputed is not None and "yolo" in precomputed:
+        detections = precomputed["yolo"]
+    else:
+        detections = analyze_image(model, image_path, frame)
     if detections:
         add_detections(conn, image_id, args.yolo_model, detections)
     else:
@@ -1267,10 +2878,11 @@ def show_yolo_custom_stats(conn: sqlite3.Connection, queries: list[str], title:
 @typechecked
 def show_yolo_stats(conn: sqlite3.Connection) -> int:
     query = '''
-        SELECT detections.label, COUNT(*)
+        SELECT labels.name, COUNT(*)
         FROM detections
+        JOIN labels ON labels.id = detections.label_id
         JOIN images ON images.id = detections.image_id
-        GROUP BY detections.label
+        GROUP BY detections.label_id
     '''
     metrics = [("Label", "Count")]
 
@@ -1404,11 +3016,20 @@ def show_statistics(conn: sqlite3.Connection) -> None:
 
 @typechecked
 def delete_from_table(conn: sqlite3.Connection, delete_status: Any, table_name: str, file_path: str, condition_column: str = "file_path") -> None:
+    value: Optional[str | int] = file_path
+
+    if condition_column == "file_path":
+        condition_column = get_file_id_column(table_name)
+        value = find_file_id(conn, file_path)
+
+        if value is None:
+            return
+
     if delete_status:
         delete_status.update(f"[bold green]Deleting from {table_name} for {file_path}...")
     query = f'DELETE FROM {table_name} WHERE {condition_column} = ?'
     dbg(query)
-    execute_with_retry(conn, query, (file_path,))
+    execute_with_retry(conn, query, (value,))
     if delete_status:
         delete_status.update(f"[bold green]Deleted from {table_name} for {file_path}.")
 
@@ -1432,6 +3053,14 @@ def delete_ocr_from_image_path(conn: sqlite3.Connection, delete_status: Any, fil
 def delete_no_faces_from_image_path(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
     delete_from_table(conn, delete_status, "no_faces", file_path)
 
+@typechecked
+def delete_no_qrcodes_from_image_path(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
+    delete_from_table(conn, delete_status, "no_qrcodes", file_path)
+
+@typechecked
+def delete_file_type_from_file_path(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
+    delete_from_table(conn, delete_status, "file_types", file_path)
+
 @typechecked
 def delete_image_description_from_image_path(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
     delete_from_table(conn, delete_status, "image_description", file_path)
@@ -1440,6 +3069,26 @@ def delete_image_description_from_image_path(conn: sqlite3.Connection, delete_st
 def delete_document_from_document_path(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
     delete_from_table(conn, delete_status, "documents", file_path)
 
+@typechecked
+def delete_file_from_files(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
+    file_id = find_file_id(conn, file_path)
+    forget_file(file_path)
+
+    if file_id is None:
+        return
+
+    if delete_status:
+        delete_status.update(f"[bold green]Deleting from files for {file_path}...")
+
+    if is_batching(conn):
+        # Right away, so the path gets a new id when something is written for it again.
+        # The batched deletes above already know the old one.
+        cursor = conn.cursor()
+        cursor_execute(cursor, 'DELETE FROM files WHERE id = ?', (file_id,))
+        cursor.close()
+    else:
+        execute_with_retry(conn, 'DELETE FROM files WHERE id = ?', (file_id,))
+
 @typechecked
 def delete_by_image_id(conn: sqlite3.Connection, delete_status: Any, table_name: str, file_path: str, foreign_key_column: str = "image_id") -> None:
     try:
@@ -1467,6 +3116,7 @@ def delete_qr_codes_from_image_path(conn: sqlite3.Connection, delete_status: Any
 @typechecked
 def delete_faces_from_image_path(conn: sqlite3.Connection, delete_status: Any, file_path: str) -> None:
     delete_by_image_id(conn, delete_status, "image_person_mapping", file_path)
+    delete_from_table(conn, delete_status, "faces", file_path)
 
 @typechecked
 def delete_entries_by_filename(conn: sqlite3.Connection, file_path: str) -> None:
@@ -1479,8 +3129,6 @@ def delete_entries_by_filename(conn: sqlite3.Connection, file_path: str) -> None
             with console.status("[bold green]Deleting files from DB that do not exist...") as delete_status:
                 delete_yolo_from_image_path(conn, delete_status, file_path)
 
-                delete_image_from_image_path(conn, delete_status, file_path)
-
                 delete_empty_images_from_image_path(conn, delete_status, file_path)
 
                 delete_ocr_from_image_path(conn, delete_status, file_path)
@@ -1495,6 +3143,16 @@ def delete_entries_by_filename(conn: sqlite3.Connection, file_path: str) -> None
 
                 delete_qr_codes_from_image_path(conn, delete_status, file_path)
 
+                delete_no_qrcodes_from_image_path(conn, delete_status, file_path)
+
+                delete_file_type_from_file_path(conn, delete_status, file_path)
+
+                # After everything that is found through the image id
+                delete_image_from_image_path(conn, delete_status, file_path)
+
+                # Last, the rows above are found through the file id
+                delete_file_from_files(conn, delete_status, file_path)
+
                 cursor.close()
                 conn.commit()
 
@@ -1511,6 +3169,15 @@ def delete_entries_by_filename(conn: sqlite3.Connection, file_path: str) -> None
 
 @typechecked
 def check_entries_in_table(conn: sqlite3.Connection, table_name: str, file_path: str | int, where_name: str = "file_path") -> int:
+    value: Optional[str | int] = file_path
+
+    if where_name == "file_path" and isinstance(file_path, str):
+        where_name = get_file_id_column(table_name)
+        value = find_file_id(conn, file_path)
+
+        if value is None:
+            return 0
+
     query = f"SELECT COUNT(*) FROM {table_name} WHERE {where_name} = ?"
 
     try:
@@ -1518,7 +3185,7 @@ def check_entries_in_table(conn: sqlite3.Connection, table_name: str, file_path:
             raise ValueError(f"Invalid table name: {table_name}")
 
         cursor = conn.cursor()
-        cursor_execute(cursor, query, (file_path,))
+        cursor_execute(cursor, query, (value,))
         count = cursor.fetchone()[0]
 
         return count
@@ -1529,7 +3196,7 @@ def check_entries_in_table(conn: sqlite3.Connection, table_name: str, file_path:
 @typechecked
 def get_existing_documents(conn: sqlite3.Connection) -> set[Any]:
     cursor = conn.cursor()
-    cursor_execute(cursor, 'SELECT file_path FROM documents')
+    cursor_execute(cursor, 'SELECT file_paths.file_path FROM documents JOIN file_paths ON file_paths.id = documents.rowid')
     rows = cursor.fetchall()
     cursor.close()
     return {row[0] for row in rows}
@@ -1555,21 +3222,21 @@ def add_file_type(conn: sqlite3.Connection, file_path: str) -> None:
     dbg(f"add_file_type(conn, {file_path})")
 
     try:
-        md5_hash = get_md5(file_path)
+        file_digest = get_file_digest(file_path)
     except FileNotFoundError:
-        print(f"Error trying to get md5 hash for file {file_path}")
+        print(f"Error trying to get the digest for file {file_path}")
         return
 
     general_type, specific_type = determine_file_types(file_path)
 
-    try:
-        execute_with_retry(
-            conn,
-            'INSERT INTO file_types (file_path, general_type, specific_type, md5) VALUES (?, ?, ?, ?)',
-            (file_path, general_type, specific_type, md5_hash)
-        )
-    except sqlite3.IntegrityError:
-        print(f"File path {file_path} already in file_types database")
+    # Files indexed again for a missing stage already have a row. An upsert, because with
+    # write batching the INSERT only runs at the next flush, where a conflict can't be caught here.
+    execute_with_retry(
+        conn,
+        '''INSERT INTO file_types (file_id, general_type, specific_type, digest) VALUES (?, ?, ?, ?)
+           ON CONFLICT(file_id) DO UPDATE SET general_type = excluded.general_type, specific_type = excluded.specific_type, digest = excluded.digest''',
+        (get_file_id(conn, file_path), general_type, specific_type, file_digest)
+    )
 
 @typechecked
 def determine_file_types(file_path: str) -> tuple[str, str]:
@@ -1585,67 +3252,131 @@ def determine_file_types(file_path: str) -> tuple[str, str]:
 @typechecked
 def add_description(conn: sqlite3.Connection, file_path: str, desc: str) -> None:
     dbg(f"add_description(conn, {file_path}, <desc>)")
-    md5_hash = get_md5(file_path)
-    execute_with_retry(conn, 'INSERT INTO image_description (file_path, image_description, md5) VALUES (?, ?, ?)', (file_path, desc, md5_hash))
+    file_digest = get_file_digest(file_path)
+    execute_with_retry(conn, 'INSERT INTO image_description (file_id, image_description, digest) VALUES (?, ?, ?)', (get_file_id(conn, file_path), desc, file_digest))
+
+@typechecked
+def add_descriptions(conn: sqlite3.Connection, descriptions: dict[str, str]) -> None:
+    dbg(f"add_descriptions(conn, <{len(descriptions)} descriptions>)")
+    rows = [(get_file_id(conn, file_path), desc, get_file_digest(file_path)) for file_path, desc in descriptions.items()]
+    executemany_with_retry(conn, 'INSERT INTO image_description (file_id, image_description, digest) VALUES (?, ?, ?)', rows)
 
 @typechecked
 def add_ocr_result(conn: sqlite3.Connection, file_path: str, extracted_text: str) -> None:
     dbg(f"add_ocr_result(conn, {file_path}, <extracted_text>)")
-    md5_hash = get_md5(file_path)
-    execute_with_retry(conn, 'INSERT INTO ocr_results (file_path, extracted_text, md5) VALUES (?, ?, ?)', (file_path, extracted_text, md5_hash))
+    file_digest = get_file_digest(file_path)
+    execute_with_retry(conn, 'INSERT INTO ocr_results (file_id, extracted_text, digest) VALUES (?, ?, ?)', (get_file_id(conn, file_path), extracted_text, file_digest))
+
+# Names of the searchable modalities, in the order their matches are shown for a file
+SEARCH_MODALITY_TITLES: dict[str, str] = {
+    "yolo": "YOLO",
+    "describe": "Description",
+    "ocr": "OCR",
+    "qrcodes": "Qr-Code",
+    "face_recognition": "Face Recognition",
+    "documents": "Document"
+}
+
+class SearchResult:
+    # All matches of one file. Every modality contributes a score between 0 and 1,
+    # so a file that matches in several modalities ranks above one that only
+    # matches in one of them.
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.score = 0.0
+        self.matches: dict[str, list[str]] = {}
+
+    def add(self, modality: str, score: float, detail: str) -> None:
+        if modality not in self.matches:
+            self.matches[modality] = []
+            self.score += score
+
+        if detail and detail not in self.matches[modality]:
+            self.matches[modality].append(detail)
+
+    def is_image(self) -> bool:
+        return any(modality != "documents" for modality in self.matches)
 
 @typechecked
-def search_yolo(conn: sqlite3.Connection) -> int:
-    yolo_results = None
+def add_limit_clause(sql_query: str, values: tuple, limit: int, offset: int) -> tuple[str, tuple]:
+    # limit 0 means no limit. SQLite only knows OFFSET together with LIMIT, where -1 is no limit.
+    if not limit and not offset:
+        return sql_query, values
 
-    if not is_existing_detections_label(conn, args.search):
-        return 0
+    return f"{sql_query} LIMIT ? OFFSET ?", values + (limit or -1, offset)
 
-    with console.status("[bold green]Searching through YOLO-results..."):
-        cursor = conn.cursor()
-        cursor_execute(cursor, '''SELECT images.file_path, detections.label, detections.confidence
-                          FROM images JOIN detections ON images.id = detections.image_id
-                          WHERE detections.label LIKE ? GROUP BY images.file_path''', (f"%{args.search}%",))
-        yolo_results = cursor.fetchall()
-        cursor.close()
+@typechecked
+def get_path_prefix_condition(path: str) -> tuple[str, tuple[str, ...]]:
+    # The file path itself, or anything in or below the directory path, on the columns
+    # of file_paths. '0' is the character after '/', so the range covers exactly the
+    # directories below path and can use the index on dirs.path.
+    directory = path.rstrip("/")
+    parent, name = split_file_path(path)
+    condition = "(file_paths.dir_path = ? OR (file_paths.dir_path >= ? AND file_paths.dir_path < ?) OR (file_paths.dir_path = ? AND file_paths.name = ?))"
+    return condition, (directory, f"{directory}/", f"{directory}0", parent, name)
 
-    nr_yolo = 0
+@typechecked
+def get_path_scope_clause() -> tuple[str, tuple[str, ...]]:
+    # Conditions for --dir and --exclude, to be appended to a WHERE clause of a query
+    # that joins file_paths
+    conditions = []
+    values: tuple[str, ...] = ()
 
-    if not args.no_sixel:
-        for row in yolo_results:
-            conf = row[2]
-            if show(row[0]):
-                if conf >= args.yolo_threshold:
-                    if not is_ignored_path(row[0]):
-                        print_file_title("YOLO", row[0], f"Certainty: {conf:.2f}")
-                        display_sixel(row[0])
-                        print("\n")
+    if args.dir:
+        condition, condition_values = get_path_prefix_condition(args.dir)
+        conditions.append(condition)
+        values += condition_values
 
-                        nr_yolo = nr_yolo + 1
-    else:
-        table = Table(title="Search Results")
-        table.add_column("File Path", justify="left", style="cyan")
-        table.add_column("Label", justify="center", style="magenta")
-        table.add_column("Confidence", justify="right", style="green")
-        for row in yolo_results:
-            conf = row[2]
-            if show(row[0]):
-                if conf >= args.yolo_threshold:
-                    if not is_ignored_path(row[0]):
-                        table.add_row(*map(str, row))
+    for excl in excluded_paths:
+        condition, condition_values = get_path_prefix_condition(excl)
+        conditions.append(f"NOT {condition}")
+        values += condition_values
+
+    return "".join(f" AND {condition}" for condition in conditions), values
+
+@typechecked
+def fts_score(relevance: float, best_relevance: float) -> float:
+    # relevance is -bm25(), which has no upper bound and depends on the words and the table.
+    # Relative to the best match of the same search it is between 0 and 1, like the other
+    # modalities' scores, and the best match gets 1.
+    if best_relevance <= 0.0:
+        return 1.0
+
+    return max(relevance, 0.0) / best_relevance
+
+@typechecked
+def find_yolo_matches(conn: sqlite3.Connection, limit: int = 0, offset: int = 0) -> Generator:
+    # The term has to be a label exactly, then the detections are found through idx_detections_label_id_confidence
+    label_id = find_label_id(conn, args.search)
+    if label_id is None:
+        return
 
-                        nr_yolo = nr_yolo + 1
+    cursor = conn.cursor()
+
+    scope, scope_values = get_path_scope_clause()
 
-        if len(yolo_results):
-            console.print(table)
+    sql_query, values = add_limit_clause(f'''SELECT file_paths.file_path, MAX(detections.confidence)
+                      FROM detections
+                      JOIN images ON images.id = detections.image_id
+                      JOIN file_paths ON file_paths.id = images.file_id
+                      WHERE detections.label_id = ? AND detections.confidence >= ?{scope}
+                      GROUP BY detections.image_id
+                      ORDER BY MAX(detections.confidence) DESC''', (label_id, args.yolo_threshold) + scope_values, limit, offset)
+    cursor_execute(cursor, sql_query, values)
 
-    return nr_yolo
+    for file_path, conf in cursor:
+        yield file_path, conf, f"{escape(args.search)} ({conf:.2f})"
+
+    cursor.close()
 
 @typechecked
-def build_sql_query_description(words: list[str]) -> tuple[str, tuple[str, ...]]:
-    conditions = ["image_description LIKE ? COLLATE NOCASE" for _ in words]
-    sql_query = f"SELECT file_path, image_description FROM image_description WHERE {' AND '.join(conditions)}"
-    values = tuple(f"%{word}%" for word in words)
+def build_sql_query_description(match_query: str) -> tuple[str, tuple[str, ...]]:
+    scope, scope_values = get_path_scope_clause()
+    sql_query = f"""SELECT file_paths.file_path, {build_fts_text_column('image_description_fts', 0)}, -bm25(image_description_fts)
+                    FROM image_description_fts JOIN image_description ON image_description.id = image_description_fts.rowid
+                    JOIN file_paths ON file_paths.id = image_description.file_id
+                    WHERE image_description_fts MATCH ?{scope} ORDER BY bm25(image_description_fts)"""
+    values = (FTS_HIGHLIGHT_START, FTS_HIGHLIGHT_END, match_query) + scope_values
     return sql_query, values
 
 @typechecked
@@ -1658,350 +3389,462 @@ def clean_search_query(query: str) -> list[str]:
     return sp
 
 @typechecked
-def search_description(conn: sqlite3.Connection) -> int:
-    ocr_results = None
+def find_fts_matches(conn: sqlite3.Connection, build_sql_query: Callable[[str], tuple[str, tuple[str, ...]]], limit: int, offset: int) -> Generator:
+    # Clean and split the search string
+    match_query = build_fts_match_query(clean_search_query(args.search))
 
-    nr_desc = 0
+    if match_query is None:
+        return
 
-    with console.status("[bold green]Searching through descriptions..."):
-        cursor = conn.cursor()
-        words = clean_search_query(args.search)  # Clean and split the search string
-        sql_query, values = build_sql_query_description(words)  # Build the SQL query dynamically
-        cursor_execute(cursor, sql_query, values)
-        ocr_results = cursor.fetchall()
-        cursor.close()
+    cursor = conn.cursor()
+    sql_query, values = build_sql_query(match_query)
+    best_relevance: Optional[float] = None
 
-    if not args.no_sixel:
-        for row in ocr_results:
-            if not is_ignored_path(row[0]):
-                if show(row[0]):
-                    print_file_title("Description", row[0])
-                    print(f"Description:\n{row[1]}\n")
-                    display_sixel(row[0])
-                    print("\n")
+    if offset:
+        # The page doesn't start with the best match, which the scores are relative to
+        cursor_execute(cursor, *add_limit_clause(sql_query, values, 1, 0))
+        best_row = cursor.fetchone()
+        if best_row:
+            best_relevance = best_row[2]
 
-                    nr_desc = nr_desc + 1
-    else:
-        table = Table(title="OCR Search Results")
-        table.add_column("File Path", justify="left", style="cyan")
-        table.add_column("Extracted Text", justify="center", style="magenta")
-        for row in ocr_results:
-            file_path, extracted_text = row
-            if not is_ignored_path(file_path):
-                if show(row[0]):
-                    table.add_row(file_path, extracted_text)
+    cursor_execute(cursor, *add_limit_clause(sql_query, values, limit, offset))
+
+    for file_path, text, relevance in cursor:
+        # The rows come best first
+        if best_relevance is None:
+            best_relevance = relevance
+
+        yield file_path, fts_score(relevance, best_relevance), highlight_matches(text)
+
+    cursor.close()
+
+@typechecked
+def find_description_matches(conn: sqlite3.Connection, limit: int = 0, offset: int = 0) -> Generator:
+    return find_fts_matches(conn, build_sql_query_description, limit, offset)
 
-                    nr_desc = nr_desc + 1
-        if len(ocr_results):
-            console.print(table)
+@typechecked
+def build_fts_match_query(words: list[str]) -> Optional[str]:
+    # Every word is quoted, so nothing that is searched for can be read as FTS5 syntax.
+    # --exact searches for the whole query as one phrase, otherwise for all words as
+    # prefixes, in any order.
+    quoted_words = ['"' + word.replace('"', '""') + '"' for word in words if word.strip()]
+
+    if not quoted_words:
+        return None
+
+    if args.exact:
+        return " ".join(quoted_words)
+
+    return " ".join(f"{word}*" for word in quoted_words)
+
+@typechecked
+def build_fts_text_column(table_name: str, column_index: int) -> str:
+    # The matches are marked with FTS_HIGHLIGHT_START/END, see highlight_matches
+    if args.full_results:
+        return f"highlight({table_name}, {column_index}, ?, ?)"
 
-    return nr_desc
+    return f"snippet({table_name}, {column_index}, ?, ?, '...', {FTS_SNIPPET_TOKENS})"
 
 @typechecked
-def build_sql_query_documents(words: list[str]) -> tuple[str, tuple[str, ...]]:
-    conditions = ["content LIKE ? COLLATE NOCASE" for _ in words]
-    sql_query = f"SELECT file_path, content FROM documents WHERE {' AND '.join(conditions)}"
-    values = tuple(f"%{word}%" for word in words)
+def build_sql_query_documents(match_query: str) -> tuple[str, tuple[str, ...]]:
+    scope, scope_values = get_path_scope_clause()
+    sql_query = f"""SELECT file_paths.file_path, {build_fts_text_column('documents', 0)}, -bm25(documents)
+                    FROM documents JOIN file_paths ON file_paths.id = documents.rowid
+                    WHERE documents MATCH ?{scope} ORDER BY bm25(documents)"""
+    values = (FTS_HIGHLIGHT_START, FTS_HIGHLIGHT_END, match_query) + scope_values
     return sql_query, values
 
 @typechecked
-def build_sql_query_ocr(words: list[str]) -> tuple[str, tuple[str, ...]]:
-    conditions = ["extracted_text LIKE ? COLLATE NOCASE" for _ in words]
-    sql_query = f"SELECT file_path, extracted_text FROM ocr_results WHERE {' AND '.join(conditions)}"
-    values = tuple(f"%{word}%" for word in words)
+def build_sql_query_ocr(match_query: str) -> tuple[str, tuple[str, ...]]:
+    scope, scope_values = get_path_scope_clause()
+    sql_query = f"""SELECT file_paths.file_path, {build_fts_text_column('ocr_results_fts', 0)}, -bm25(ocr_results_fts)
+                    FROM ocr_results_fts JOIN ocr_results ON ocr_results.id = ocr_results_fts.rowid
+                    JOIN file_paths ON file_paths.id = ocr_results.file_id
+                    WHERE ocr_results_fts MATCH ?{scope} ORDER BY bm25(ocr_results_fts)"""
+    values = (FTS_HIGHLIGHT_START, FTS_HIGHLIGHT_END, match_query) + scope_values
     return sql_query, values
 
 @typechecked
-def print_text_with_keywords(file_path: str, text: str, keywords: list[str], full_results: bool) -> None:
-    keyword_pattern = "|".join(re.escape(keyword) for keyword in keywords)
+def highlight_matches(text: str) -> str:
+    # Rich markup for a snippet()/highlight() result
+    return escape(text).replace(FTS_HIGHLIGHT_START, "[bold reverse underline2 italic green]").replace(FTS_HIGHLIGHT_END, "[/]")
 
-    class SearchHighlighter(RegexHighlighter):
-        base_style = "search_highlighter."
-        highlights = [rf"(?P<matches>{keyword_pattern})"]
+@typechecked
+def find_document_matches(conn: sqlite3.Connection, limit: int = 0, offset: int = 0) -> Generator:
+    return find_fts_matches(conn, build_sql_query_documents, limit, offset)
 
-    theme = Theme({"search_highlighter.matches": "bold reverse underline2 italic green"})
-    highlighter_console = Console(highlighter=SearchHighlighter(), theme=theme)
+@typechecked
+def find_ocr_matches(conn: sqlite3.Connection, limit: int = 0, offset: int = 0) -> Generator:
+    return find_fts_matches(conn, build_sql_query_ocr, limit, offset)
 
-    if full_results:
-        highlighter_console.print(Panel.fit(text, title=file_path))
-    else:
-        lines = text.split('\n')
+@typechecked
+def find_qrcode_matches(conn: sqlite3.Connection, limit: int = 0, offset: int = 0) -> Generator:
+    cursor = conn.cursor()
+    scope, scope_values = get_path_scope_clause()
+    # One row per image, so a LIMIT counts images and not qr-codes
+    query = f'''
+        SELECT file_paths.file_path, group_concat(content, ', ')
+        FROM images
+        JOIN qrcodes ON images.id = qrcodes.image_id
+        JOIN file_paths ON file_paths.id = images.file_id
+        WHERE content like ?{scope}
+        GROUP BY images.id
+    '''
+    cursor_execute(cursor, *add_limit_clause(query, (f"%{args.search}%",) + scope_values, limit, offset))
+
+    for file_path, content in cursor:
+        yield file_path, 1.0, escape(content)
+
+    cursor.close()
 
-        matching_lines = []
+@typechecked
+def find_face_matches(conn: sqlite3.Connection, limit: int = 0, offset: int = 0) -> Generator:
+    cursor = conn.cursor()
+    scope, scope_values = get_path_scope_clause()
+    query = f'''
+        SELECT file_paths.file_path, group_concat(person.name, ', ')
+        FROM person
+        JOIN image_person_mapping ON person.id = image_person_mapping.person_id
+        JOIN images ON images.id = image_person_mapping.image_id
+        JOIN file_paths ON file_paths.id = images.file_id
+        WHERE person.name LIKE ?{scope}
+        GROUP BY images.id
+    '''
+    cursor_execute(cursor, *add_limit_clause(query, (f"%{args.search}%",) + scope_values, limit, offset))
 
-        for line in lines:
-            for keyword in keywords:
-                if keyword.lower() in line.lower():
-                    matching_lines.append(line)
+    for file_path, names in cursor:
+        yield file_path, 1.0, escape(names)
 
-        joined_matching_lines = "\n".join(matching_lines)
+    cursor.close()
 
-        highlighter_console.print(Panel.fit(joined_matching_lines, title=file_path))
+# Each one yields (file_path, score, detail) lazily from its cursor, at most one row
+# per file, and takes the LIMIT and OFFSET for its query
+SEARCH_MODALITY_FINDERS: dict[str, Callable[..., Generator]] = {
+    "yolo": find_yolo_matches,
+    "ocr": find_ocr_matches,
+    "describe": find_description_matches,
+    "qrcodes": find_qrcode_matches,
+    "face_recognition": find_face_matches,
+    "documents": find_document_matches
+}
 
 @typechecked
-def search_documents(conn: sqlite3.Connection) -> int:
-    ocr_results = None
-    nr_documents = 0
+def find_modality_matches(modality: str, limit: int, offset: int) -> list[tuple[str, float, str]]:
+    # Runs in a thread of its own. sqlite3 connections can't be shared between
+    # threads, and read-only ones never wait for an indexer that is writing.
+    conn = connect_database(args.dbfile, read_only=True)
 
-    with console.status("[bold green]Searching through documents..."):
-        cursor = conn.cursor()
+    try:
+        return list(SEARCH_MODALITY_FINDERS[modality](conn, limit, offset))
+    finally:
+        conn.close()
 
-        # Clean and split the search string
-        words = clean_search_query(args.search)
+@typechecked
+def get_search_modalities() -> list[str]:
+    search_flags = {
+        "yolo": args.yolo,
+        "ocr": args.ocr,
+        "describe": args.describe,
+        "face_recognition": args.face_recognition,
+        "documents": args.documents,
+        "qrcodes": args.qrcodes
+    }
 
-        # Build the SQL query dynamically
-        sql_query, values = build_sql_query_documents(words)
-        cursor_execute(cursor, sql_query, values)
-        ocr_results = cursor.fetchall()
-        cursor.close()
+    # Wenn keine Flags gesetzt sind, alle aktivieren
+    if not any(search_flags.values()):
+        return list(search_flags)
 
-    for row in ocr_results:
-        if not is_ignored_path(row[0]):
-            if show(row[0]):
-                try:
-                    print_text_with_keywords(row[0], f"Text:\n{row[1]}\n", words, args.full_results)
-                except rich.errors.MarkupError:
-                    print_file_title("Document", row[0])
-                    try:
-                        console.print(f"Text:\n{row[1]}\n")
-                    except Exception:
-                        print(f"Text:\n{row[1]}\n")
-                print("\n")
-                nr_documents += 1
+    return [flag for flag, enabled in search_flags.items() if enabled]
 
-    return nr_documents
+@typechecked
+def can_limit_in_sql(modalities: list[str]) -> bool:
+    # Only then every row the database returns is a file that is shown, because no
+    # file can come from two modalities
+    return len(modalities) == 1
 
 @typechecked
-def search_ocr(conn: sqlite3.Connection) -> int:
-    ocr_results = None
-    nr_ocr = 0
+def merge_search_matches(matches: dict[str, list[tuple[str, float, str]]]) -> list[SearchResult]:
+    results: dict[str, SearchResult] = {}
 
-    with console.status("[bold green]Searching through OCR results..."):
-        cursor = conn.cursor()
+    for modality, rows in matches.items():
+        for file_path, score, detail in rows:
+            if file_path not in results:
+                results[file_path] = SearchResult(file_path)
 
-        # Clean and split the search string
-        words = clean_search_query(args.search)
+            results[file_path].add(modality, score, detail)
 
-        # Build the SQL query dynamically
-        sql_query, values = build_sql_query_ocr(words)
-        cursor_execute(cursor, sql_query, values)
-        ocr_results = cursor.fetchall()
-        cursor.close()
+    # Stable, so files with the same score stay in the order they were found in
+    return sorted(results.values(), key=lambda result: result.score, reverse=True)
 
-    if not args.no_sixel:
-        for row in ocr_results:
-            if not is_ignored_path(row[0]):
-                if show(row[0]):
-                    print_file_title("OCR", row[0])
-                    print_text_with_keywords(row[0], f"Extracted Text:\n{row[1]}\n", words, args.full_results)
-                    display_sixel(row[0])
-                    print("\n")
-                    nr_ocr += 1
-    else:
-        table = Table(title="OCR Search Results")
-        table.add_column("File Path", justify="left", style="cyan")
-        table.add_column("Extracted Text", justify="center", style="magenta")
-        for row in ocr_results:
-            file_path, extracted_text = row
-            if not is_ignored_path(file_path):
-                if show(row[0]):
-                    table.add_row(file_path, extracted_text)
-                    nr_ocr += 1
+@typechecked
+def find_search_results(modalities: list[str]) -> tuple[list[SearchResult], Optional[int]]:
+    # Returns the page of results that is shown, and the number of files before paging,
+    # which is unknown when the database did the paging
+    matches: dict[str, list[tuple[str, float, str]]] = {}
+    limit_in_sql = can_limit_in_sql(modalities)
+
+    with console.status(f"[bold green]Searching through {', '.join(SEARCH_MODALITY_TITLES[modality] for modality in modalities)}..."):
+        with ThreadPoolExecutor(max_workers=len(modalities)) as executor:
+            if limit_in_sql:
+                futures = {modality: executor.submit(find_modality_matches, modality, args.limit, args.offset) for modality in modalities}
+            else:
+                futures = {modality: executor.submit(find_modality_matches, modality, 0, 0) for modality in modalities}
+
+            for modality, future in futures.items():
+                matches[modality] = future.result()
+
+    results = merge_search_matches(matches)
 
-        if len(ocr_results):
-            console.print(table)
+    if limit_in_sql:
+        return results, None
 
-    return nr_ocr
+    nr_results = len(results)
+    results = results[args.offset:]
+    if args.limit:
+        results = results[:args.limit]
+
+    return results, nr_results
 
 @typechecked
-def search_qrcodes(conn: sqlite3.Connection) -> int:
-    qr_code_imgs = []
+def format_search_matches(result: SearchResult) -> str:
+    lines = []
+
+    for modality, title in SEARCH_MODALITY_TITLES.items():
+        if modality in result.matches:
+            details = result.matches[modality]
+            if details:
+                lines.append(f"{title}: {', '.join(details)}" if modality in ["yolo", "qrcodes", "face_recognition"] else f"{title}:\n" + "\n".join(details))
+            else:
+                lines.append(title)
 
-    with console.status("[bold green]Searching for qr-codes..."):
-        cursor = conn.cursor()
-        query = '''
-            SELECT images.file_path, content
-            FROM images
-            JOIN qrcodes ON images.id = qrcodes.image_id
-            WHERE content like ?
-        '''
-        cursor_execute(cursor, query, (f"%{args.search}%",))
-        qr_code_imgs = cursor.fetchall()
-        cursor.close()
+    return "\n".join(lines)
 
-    nr_qrcodes = 0
-
-    if not args.no_sixel:
-        for row in qr_code_imgs:
-            if show(row[0]):
-                print_file_title("Qr-Code", row[0])
-                print("\nQr-Code content:")
-                print(row[1])
-                print("\n")
-                display_sixel(row[0])  # Falls Sixel angezeigt werden soll
-                print("\n")
-                nr_qrcodes += 1
+@typechecked
+def print_search_result(result: SearchResult) -> None:
+    if shows_sixel():
+        print_file_title("Search result", result.file_path, f"Score: {result.score:.2f}\n{format_search_matches(result)}")
+
+        if result.is_image():
+            display_sixel(result.file_path)
+        print("\n")
     else:
-        table = Table(title="Qr-Codes Results")
-        table.add_column("File Path", justify="left", style="cyan")
-        for row in qr_code_imgs:
-            if show(row[0]):
-                table.add_row(row[0])
+        console.print(f"[cyan]{escape(result.file_path)}[/]\n{format_search_matches(result)}\n")
 
-        if len(qr_code_imgs):
-            console.print(table)
+@typechecked
+def print_search_results(results: list[SearchResult]) -> None:
+    if shows_sixel():
+        for result in results:
+            print_search_result(result)
+    else:
+        table = Table(title="Search Results")
+        table.add_column("File Path", justify="left", style="cyan")
+        table.add_column("Score", justify="right", style="green")
+        table.add_column("Matches", justify="left", style="magenta")
 
-        nr_qrcodes = len(qr_code_imgs)
+        for result in results:
+            table.add_row(escape(result.file_path), f"{result.score:.2f}", format_search_matches(result))
 
-    return nr_qrcodes
+        console.print(table)
 
 @typechecked
-def search_faces(conn: sqlite3.Connection) -> int:
-    person_results = None
+def stream_search_results(modalities: list[str]) -> list[SearchResult]:
+    # Shows every file as soon as its row comes from the database, modality by modality,
+    # and stops reading once --limit files were shown. A file is only shown for the
+    # first modality it matched in.
+    shown: list[SearchResult] = []
+    seen: set[str] = set()
+    limit_in_sql = can_limit_in_sql(modalities)
+    nr_skipped = args.offset if limit_in_sql else 0
 
-    cursor = conn.cursor()
-    cursor_execute(cursor, 'SELECT id FROM person WHERE name LIKE ?', (f"%{args.search}%",))
-    person_results = cursor.fetchall()
-    cursor.close()
+    conn = connect_database(args.dbfile, read_only=True)
+
+    try:
+        for modality in modalities:
+            if limit_in_sql:
+                matches = SEARCH_MODALITY_FINDERS[modality](conn, args.limit, args.offset)
+            else:
+                matches = SEARCH_MODALITY_FINDERS[modality](conn)
 
-    if not person_results:
-        return 0  # Keine Person gefunden
+            for file_path, score, detail in matches:
+                if file_path in seen:
+                    continue
 
-    # Suchen nach Bildern, die mit der gefundenen Person verknüpft sind
-    with console.status("[bold green]Searching for images of the person..."):
-        cursor = conn.cursor()
-        person_ids = tuple(str(row[0]) for row in person_results)
-
-        placeholders = ",".join("?" * len(person_ids))  # Platzhalter für die IDs der Personen
-        query = f'''
-            SELECT images.file_path
-            FROM images
-            JOIN image_person_mapping ON images.id = image_person_mapping.image_id
-            WHERE image_person_mapping.person_id IN ({placeholders})
-        '''
-        cursor_execute(cursor, query, person_ids)
-        person_images = cursor.fetchall()
-        cursor.close()
+                seen.add(file_path)
 
-    nr_images = 0
+                if nr_skipped < args.offset:
+                    nr_skipped += 1
+                    continue
 
-    if not args.no_sixel:
-        for row in person_images:
-            if show(row[0]):
-                print_file_title("Face Recognition", row[0])
-                display_sixel(row[0])  # Falls Sixel angezeigt werden soll
-                print("\n")
-                nr_images += 1
-    else:
-        table = Table(title="Person Image Results")
-        table.add_column("File Path", justify="left", style="cyan")
-        for row in person_images:
-            if show(row[0]):
-                table.add_row(row[0])
+                result = SearchResult(file_path)
+                result.add(modality, score, detail)
+                print_search_result(result)
+                shown.append(result)
+
+                if args.limit and len(shown) >= args.limit:
+                    matches.close()
+                    return shown
+    finally:
+        conn.close()
+
+    return shown
+
+@typechecked
+def print_search_overview(modalities: list[str], results: list[SearchResult], nr_results: Optional[int]) -> None:
+    table = Table(title="Search overview")
+    row = []
 
-        if len(person_images):
-            console.print(table)
+    for modality in modalities:
+        nr_modality_results = sum(1 for result in results if modality in result.matches)
+        if nr_modality_results:
+            row.append(str(nr_modality_results))
+            table.add_column(f"Nr. {modality.capitalize()} Results", justify="left", style="cyan")
 
-        nr_images = len(person_images)
+    table.add_column("Nr. Files", justify="left", style="cyan")
+    row.append(f"{len(results)} of {nr_results}" if nr_results is not None and len(results) != nr_results else str(len(results)))
 
-    return nr_images
+    table.add_row(*row)
+    console.print(table)
 
 @typechecked
-def search(conn: sqlite3.Connection) -> None:
+def search() -> None:
     try:
-        table = Table(title="Search overview")
-        search_flags = {
-            "yolo": args.yolo,
-            "ocr": args.ocr,
-            "describe": args.describe,
-            "face_recognition": args.face_recognition,
-            "documents": args.documents,
-            "qrcodes": args.qrcodes
-        }
-
-        # Wenn keine Flags gesetzt sind, alle aktivieren
-        if not any(search_flags.values()):
-            search_flags = {key: True for key in search_flags}
-
-        results = {
-            "yolo": search_yolo,
-            "ocr": search_ocr,
-            "describe": search_description,
-            "qrcodes": search_qrcodes,
-            "face_recognition": search_faces,
-            "documents": search_documents
-        }
-
-        row = []
-        for flag, enabled in search_flags.items():
-            if enabled:
-                result = results[flag](conn)
-                if result:
-                    row.append(str(result))
-                    table.add_column(f"Nr. {flag.capitalize()} Results", justify="left", style="cyan")
-
-        if not row:
+        modalities = get_search_modalities()
+
+        nr_results: Optional[int] = None
+
+        if args.stream:
+            results = stream_search_results(modalities)
+        else:
+            results, nr_results = find_search_results(modalities)
+
+            if results:
+                print_search_results(results)
+
+        if not results:
             console.print("[yellow]No results found[/]")
-        else:
-            table.add_row(*row)
-            console.print(table)
+            return
+
+        print_search_overview(modalities, results, nr_results)
     except sqlite3.OperationalError as e:
         console.print(f"[red]Error while running sqlite-query: {e}[/]")
 
 @typechecked
-def yolo_file(conn: sqlite3.Connection, image_path: str, existing_files: Optional[dict], model: Any) -> None:
+def needs_yolo(conn: sqlite3.Connection, image_path: str, existing_files: Optional[dict]) -> bool:
+    indexed = is_in_indexed_stage("yolo", image_path)
+    if indexed is not None:
+        return not indexed
+
+    return not is_file_in_yolo_db(conn, image_path, existing_files) and not is_image_indexed(conn, image_path)
+
+@typechecked
+def yolo_file(conn: sqlite3.Connection, image_path: str, existing_files: Optional[dict], model: Any, frame: Optional[DecodedImage] = None, precomputed: Optional[dict] = None) -> None:
     if model is None:
         return
 
-    if is_file_in_yolo_db(conn, image_path, existing_files):
+    if precomputed is not None and "yolo" in precomputed:
+        # The batch that computed these detections has already checked the database
+        process_image(image_path, model, conn, frame, precomputed)
+        if existing_files is not None:
+            existing_files[image_path] = get_file_digest(image_path)
+    elif not needs_yolo(conn, image_path, existing_files):
         console.print(f"[green]Image {image_path} already in yolo-database. Skipping it.[/]")
     else:
-        if is_image_indexed(conn, image_path):
-            console.print(f"[green]Image {image_path} already indexed. Skipping it.[/]")
-        else:
-            process_image(image_path, model, conn)
-            if existing_files is not None:
-                existing_files[image_path] = get_md5(image_path)
+        process_image(image_path, model, conn, frame)
+        if existing_files is not None:
+            existing_files[image_path] = get_file_digest(image_path)
 
 @typechecked
-def get_image_description(image_path: str) -> str:
+def load_blip_models() -> bool:
     global blip_model, blip_processor
 
-    try:
-        image = PIL.Image.open(image_path).convert("RGB")
-        if blip_processor is None:
-            import transformers
+    if blip_processor is None:
+        import transformers
 
-            from transformers import BlipProcessor, BlipForConditionalGeneration
+        from transformers import BlipProcessor, BlipForConditionalGeneration
 
-            blip_processor = BlipProcessor.from_pretrained(args.blip_model_name)
-            blip_model = BlipForConditionalGeneration.from_pretrained(args.blip_model_name)
+        blip_processor = BlipProcessor.from_pretrained(args.blip_model_name)
+        blip_model = BlipForConditionalGeneration.from_pretrained(args.blip_model_name)
 
-        if blip_processor is None:
-            console.print("blip_processor was none. Cannot describe image.")
-            return ""
+    if blip_processor is None:
+        console.print("blip_processor was none. Cannot describe image.")
+        return False
 
-        if blip_model is None:
-            console.print("blip_model was none. Cannot describe image.")
-            return ""
+    if blip_model is None:
+        console.print("blip_model was none. Cannot describe image.")
+        return False
+
+    return True
 
-        inputs = blip_processor(images=image, return_tensors="pt")
+@typechecked
+def generate_captions(images: list) -> list[str]:
+    import torch
 
+    with torch.inference_mode():
+        inputs = blip_processor(images=images, return_tensors="pt")
         outputs = blip_model.generate(**inputs)
-        caption = blip_processor.decode(outputs[0], skip_special_tokens=True)
 
-        return caption
+    return blip_processor.batch_decode(outputs, skip_special_tokens=True)
+
+@typechecked
+def get_image_description(image_path: str, frame: Optional[DecodedImage] = None) -> str:
+    import PIL.Image
+
+    try:
+        if frame is not None:
+            image = frame.pil
+        else:
+            image = PIL.Image.open(image_path).convert("RGB")
+
+        if not load_blip_models():
+            return ""
+
+        return generate_captions([image])[0]
     except (OSError, PIL.UnidentifiedImageError, PIL.Image.DecompressionBombError) as e:
         console.print(f"File {image_path} failed with error {e}")
         return ""
 
 @typechecked
-def describe_img(conn: sqlite3.Connection, image_path: str) -> None:
+def get_image_descriptions(frames: list[DecodedImage]) -> dict[str, str]:
+    import PIL.Image
+
+    descriptions: dict[str, str] = {}
+
+    loaded_frames = []
+
+    for frame in frames:
+        try:
+            loaded_frames.append((frame.pil.size, frame))
+        except (OSError, PIL.UnidentifiedImageError, PIL.Image.DecompressionBombError) as e:
+            console.print(f"File {frame.image_path} failed with error {e}")
+            descriptions[frame.image_path] = ""
+
+    if not loaded_frames or not load_blip_models():
+        return descriptions
+
+    # Images of the same size end up next to each other, so the batches are preprocessed alike
+    loaded_frames.sort(key=lambda item: item[0])
+
+    for batch in chunk_list([frame for _, frame in loaded_frames], args.blip_batch_size):
+        console.print(f"[bright_yellow]Describing {len(batch)} images with blip[/]")
+
+        try:
+            captions = generate_captions([frame.pil for frame in batch])
+        except (RuntimeError, ValueError) as e:
+            console.print(f"[red]Describing {len(batch)} images failed with error {e}[/]")
+            captions = [""] * len(batch)
+
+        for frame, caption in zip(batch, captions):
+            descriptions[frame.image_path] = caption
+
+    return descriptions
+
+@typechecked
+def describe_img(conn: sqlite3.Connection, image_path: str, frame: Optional[DecodedImage] = None) -> None:
     if is_file_in_img_desc_db(conn, image_path):
         console.print(f"[green]Image {image_path} already in image-description-database. Skipping it.[/]")
     else:
         try:
-            image_description = get_image_description(image_path)
+            image_description = get_image_description(image_path, frame)
             if image_description:
                 console.print(f"[green]Saved description '{image_description}' for {image_path}[/]")
                 add_description(conn, image_path, image_description)
@@ -2013,33 +3856,37 @@ def describe_img(conn: sqlite3.Connection, image_path: str) -> None:
             console.print(f"[red]File {image_path} not found[/]")
 
 @typechecked
-def ocr_file(conn: sqlite3.Connection, image_path: str) -> None:
-    if is_file_in_ocr_db(conn, image_path):
+def ocr_file(conn: sqlite3.Connection, image_path: str, frame: Optional[DecodedImage] = None, precomputed: Optional[dict] = None) -> None:
+    if precomputed is not None and "ocr" in precomputed:
+        save_ocr_result(conn, image_path, precomputed["ocr"])
+    elif is_file_in_ocr_db(conn, image_path):
         console.print(f"[green]Image {image_path} already in ocr-database. Skipping it.[/]")
     else:
         try:
             file_size = os.path.getsize(image_path)
 
             if file_size < args.max_size * 1024 * 1024:
-                extracted_text = ocr_img(image_path)
-                if extracted_text:
-                    texts = [item[1] for item in extracted_text]
-                    text = " ".join(texts)
-                    if text:
-                        add_ocr_result(conn, image_path, text)
-                        console.print(f"[green]Saved OCR for {image_path}[/]")
-                    else:
-                        console.print(f"[yellow]Image {image_path} contains no text. Saving it as empty.[/]")
-                        add_ocr_result(conn, image_path, "")
-                else:
-                    console.print(f"[yellow]Image {image_path} contains no text. Saving it as empty.[/]")
-                    add_ocr_result(conn, image_path, "")
-
+                save_ocr_result(conn, image_path, ocr_img(image_path, frame))
             else:
                 console.print(f"[red]Image {image_path} is too large. Will skip OCR. Max-Size: {args.max_size}MB, is {file_size / 1024 / 1024}MB[/]")
         except FileNotFoundError:
             console.print(f"[red]File {image_path} not found[/]")
 
+@typechecked
+def save_ocr_result(conn: sqlite3.Connection, image_path: str, extracted_text: Optional[list]) -> None:
+    if extracted_text:
+        texts = [item[1] for item in extracted_text]
+        text = " ".join(texts)
+        if text:
+            add_ocr_result(conn, image_path, text)
+            console.print(f"[green]Saved OCR for {image_path}[/]")
+        else:
+            console.print(f"[yellow]Image {image_path} contains no text. Saving it as empty.[/]")
+            add_ocr_result(conn, image_path, "")
+    else:
+        console.print(f"[yellow]Image {image_path} contains no text. Saving it as empty.[/]")
+        add_ocr_result(conn, image_path, "")
+
 @typechecked
 def is_valid_file_path(path: str) -> bool:
     try:
@@ -2052,6 +3899,8 @@ def is_valid_file_path(path: str) -> bool:
 
 @typechecked
 def is_valid_image_file(path: str) -> bool:
+    import PIL.Image
+
     try:
         if not os.path.isfile(path):
             return False
@@ -2117,12 +3966,18 @@ def ask_confirmation() -> bool:
 def get_value_by_condition(conn: sqlite3.Connection, table: str, field: str, search_by: str, where_column: str) -> Optional[str]:
     query = ""
     try:
+        value: Optional[str | int] = search_by
+
+        if where_column == "file_path":
+            where_column = get_file_id_column(table)
+            value = find_file_id(conn, search_by)
+
         # Construct the SQL query with placeholders
         query = f"SELECT {field} FROM {table} WHERE {where_column} = ?"
 
         # Execute the query
         cursor = conn.cursor()
-        cursor_execute(cursor, query, (search_by,))
+        cursor_execute(cursor, query, (value,))
         result = cursor.fetchone()
 
         # Return the value if found, otherwise None
@@ -2197,6 +4052,8 @@ def handle_document_options(conn: sqlite3.Connection, file_path: str, options: l
 
 @typechecked
 def show_options_for_file(conn: sqlite3.Connection, file_path: str) -> None:
+    import requests
+
     strs = {
         "show_image_again": "Show image again",
         "mark_image_as_no_face": "Mark image as 'contains no face'",
@@ -2336,54 +4193,565 @@ def search_or_show_file(conn: sqlite3.Connection) -> None:
         while True:
             show_options_for_file(conn, args.search)
     else:
-        search(conn)
+        search()
 
-def index_image_file(conn: sqlite3.Connection, image_path: str, existing_files: Optional[dict], model: Any) -> None:
-    if os.path.exists(image_path):
-        if args.yolo or args.ocr or args.qrcodes or args.describe or do_all:
-            console.print(f"===========> {image_path} ===========>")
+def index_frame(conn: sqlite3.Connection, frame: DecodedImage, existing_files: Optional[dict], model: Any, precomputed: Optional[dict] = None) -> None:
+    image_path = frame.image_path
 
-            display_sixel(image_path)
+    if args.yolo or args.ocr or args.qrcodes or args.describe or do_all:
+        console.print(f"===========> {image_path} ===========>")
 
-        if args.describe or do_all:
-            describe_img(conn, image_path)
-        if args.yolo or do_all:
-            if model is not None:
-                yolo_file(conn, image_path, existing_files, model)
-            else:
-                global yolo_error_already_shown
+        # With --jobs, the writer process should not decode the image just to show it
+        if args.jobs == 1:
+            display_sixel(image_path, frame)
+
+    if (args.describe or do_all) and not (precomputed is not None and "describe" in precomputed):
+        # Descriptions computed by index_image_batch have already been saved in bulk
+        describe_img(conn, image_path, frame)
+    if args.yolo or do_all:
+        if model is not None:
+            yolo_file(conn, image_path, existing_files, model, frame, precomputed)
+        else:
+            global yolo_error_already_shown
 
-                if not yolo_error_already_shown:
-                    console.print("[red]--yolo was set, but model could not be loaded[/]")
+            if not yolo_error_already_shown:
+                console.print("[red]--yolo was set, but model could not be loaded[/]")
+
+                yolo_error_already_shown = True
+    if args.ocr or do_all:
+        ocr_file(conn, image_path, frame, precomputed)
 
-                    yolo_error_already_shown = True
-        if args.ocr or do_all:
-            ocr_file(conn, image_path)
+    if args.qrcodes or do_all:
+        add_qrcodes_from_image(conn, image_path, frame, precomputed)
 
-        if args.qrcodes or do_all:
-            add_qrcodes_from_image(conn, image_path)
+def index_image_file(conn: sqlite3.Connection, image_path: str, existing_files: Optional[dict], model: Any) -> None:
+    if os.path.exists(image_path):
+        with DecodedImage(image_path) as frame:
+            index_frame(conn, frame, existing_files, model)
     else:
         console.print(f"[red]Could not find {image_path}[/]")
 
-def run_face_recognition_on_single_image(conn: sqlite3.Connection, image_path: str, progress: Any) -> None:
+def save_descriptions(conn: sqlite3.Connection, descriptions: dict[str, str]) -> None:
+    for image_path, description in descriptions.items():
+        if description:
+            console.print(f"[green]Saved description '{description}' for {image_path}[/]")
+        else:
+            console.print(f"[yellow]Image {image_path} could not be described. Saving it as empty.[/]")
+
+    add_descriptions(conn, descriptions)
+
+def get_pending_stages(conn: sqlite3.Connection, image_path: str, existing_files: Optional[dict], model: Any) -> list[str]:
+    stages = []
+
+    if (args.describe or do_all) and not is_file_in_img_desc_db(conn, image_path):
+        stages.append("describe")
+
+    if (args.yolo or do_all) and model is not None and needs_yolo(conn, image_path, existing_files):
+        stages.append("yolo")
+
+    if (args.ocr or do_all) and not is_file_in_ocr_db(conn, image_path) and os.path.getsize(image_path) < args.max_size * 1024 * 1024:
+        stages.append("ocr")
+
+    if (args.qrcodes or do_all) and not qr_code_already_existing(conn, image_path):
+        stages.append("qrcodes")
+
+    return stages
+
+worker_model: Any = None
+
+def init_index_worker(model: Any) -> None:
+    global worker_model
+
+    worker_model = model
+
     try:
-        file_size = os.path.getsize(image_path)
+        import torch
 
-        if file_size < args.max_size * 1024 * 1024:
-            recognized_faces = recognize_persons_in_image(conn, image_path, progress)
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.jobs))
+    except ModuleNotFoundError:
+        pass
 
-            if recognized_faces is None:
-                console.print(f"[red]There was an error analyzing the file {image_path} for faces[/]")
-            else:
-                new_ids, manually_entered_name = recognized_faces
+    if args.describe or do_all:
+        load_blip_models()
 
-                if len(new_ids) and not manually_entered_name:
-                    console.print(f"[green]In the following image, those persons were detected: {', '.join(new_ids)}")
-                    display_sixel(image_path)
+def analyze_image_file_in_worker(task: tuple[str, list[str]]) -> tuple[str, dict]:
+    image_path, stages = task
+
+    results: dict[str, Any] = {}
+
+    try:
+        with DecodedImage(image_path) as frame:
+            if "describe" in stages:
+                results["describe"] = get_image_description(image_path, frame)
+
+            if "yolo" in stages:
+                results["yolo"] = analyze_image(worker_model, image_path, frame)
+
+            if "ocr" in stages:
+                results["ocr"] = ocr_img(image_path, frame)
+
+            if "qrcodes" in stages:
+                results["qrcodes"] = get_qr_codes_from_image(image_path, frame)
+    except Exception as e:
+        # The writer analyzes the missing stages itself
+        console.print(f"[red]Worker failed to analyze {image_path}: {e}[/]")
+
+    return image_path, results
+
+def index_images_in_parallel(conn: sqlite3.Connection, image_paths: list[str], existing_files: Optional[dict], model: Any, progress: Any, task: Any) -> None:
+    tasks = []
+
+    for image_path in image_paths:
+        if os.path.exists(image_path):
+            tasks.append((image_path, get_pending_stages(conn, image_path, existing_files, model)))
         else:
+            console.print(f"[red]Could not find {image_path}[/]")
+            progress.update(task, advance=1)
+
+    # Workers only analyze, this process is the only one that writes to the database
+    with multiprocessing.get_context("fork").Pool(args.jobs, initializer=init_index_worker, initargs=(model,)) as pool:
+        # Started after forking, the workers don't need the hashing threads
+        start_digest_prefetch([image_path for image_path, _ in tasks])
+
+        for image_path, results in pool.imap_unordered(analyze_image_file_in_worker, tasks):
+            if "describe" in results:
+                save_descriptions(conn, {image_path: results["describe"]})
+
+            with DecodedImage(image_path) as frame:
+                index_frame(conn, frame, existing_files, model, results)
+
+            add_file_type(conn, image_path)
+            maybe_flush_writes(conn)
+            progress.update(task, advance=1)
+
+def get_index_batch_size() -> int:
+    batch_size = 1
+
+    if args.yolo or do_all:
+        batch_size = max(batch_size, args.yolo_batch_size)
+
+    if args.describe or do_all:
+        batch_size = max(batch_size, args.blip_batch_size)
+
+    return batch_size
+
+def index_image_batch(conn: sqlite3.Connection, image_paths: list[str], existing_files: Optional[dict], model: Any) -> None:
+    if len(image_paths) == 1:
+        index_image_file(conn, image_paths[0], existing_files, model)
+        return
+
+    frames: dict[str, DecodedImage] = {}
+
+    try:
+        for image_path in image_paths:
+            if os.path.exists(image_path):
+                frames[image_path] = DecodedImage(image_path)
+            else:
+                console.print(f"[red]Could not find {image_path}[/]")
+
+        yolo_results: dict[str, Optional[list]] = {}
+        descriptions: dict[str, str] = {}
+
+        if (args.yolo or do_all) and model is not None and args.yolo_batch_size > 1:
+            pending = [frame for image_path, frame in frames.items() if needs_yolo(conn, image_path, existing_files)]
+
+            yolo_results = analyze_images(model, pending)
+
+        if (args.describe or do_all) and args.blip_batch_size > 1:
+            pending = [frame for image_path, frame in frames.items() if not is_file_in_img_desc_db(conn, image_path)]
+
+            descriptions = get_image_descriptions(pending)
+
+            save_descriptions(conn, descriptions)
+
+        for image_path, frame in frames.items():
+            precomputed: dict[str, Any] = {}
+            if image_path in yolo_results:
+                precomputed["yolo"] = yolo_results[image_path]
+            if image_path in descriptions:
+                precomputed["describe"] = descriptions[image_path]
+
+            index_frame(conn, frame, existing_files, model, precomputed)
+            frame.close()
+    finally:
+        for frame in frames.values():
+            frame.close()
+
+@typechecked
+def extract_faces_from_file(image_path: str) -> tuple[str, Optional[tuple[list, list, list]]]:
+    import PIL.Image
+
+    try:
+        file_size = os.path.getsize(image_path)
+
+        if file_size >= args.max_size * 1024 * 1024:
             console.print(f"[yellow]The image {image_path} is too large for face recognition (), --max_size: {args.max_size}MB, file-size: ~{int(file_size / 1024 / 1024)}MB. Try increasing --max_size")
+            return image_path, None
+
+        with DecodedImage(image_path) as frame:
+            return image_path, extract_faces(image_path, frame)
     except FileNotFoundError:
         console.print(f"[red]The file {image_path} was not found[/]")
+    except PIL.UnidentifiedImageError:
+        console.print(f"[red]There was an error analyzing the file {image_path} for faces[/]")
+
+    return image_path, None
+
+def extract_faces_in_parallel(image_paths: list[str], progress: Any, task: Any) -> Generator:
+    # Yields (path, (encodings, locations, crop hashes)). Nothing in here asks anything, so it can
+    # run in --jobs worker processes.
+    pool = multiprocessing.get_context("fork").Pool(args.jobs) if args.jobs > 1 else None
+
+    try:
+        results = pool.imap_unordered(extract_faces_from_file, image_paths) if pool is not None else map(extract_faces_from_file, image_paths)
+
+        for image_path, extracted in results:
+            progress.update(task, advance=1)
+
+            if extracted is not None:
+                yield image_path, extracted
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+@typechecked
+def cluster_face_encodings(encodings: numpy.ndarray, eps: float) -> list[list[int]]:
+    import numpy
+
+    # DBSCAN with the face distance. Faces that are in no cluster come back as
+    # clusters of their own, so every face gets asked for exactly once.
+    neighbours: list[numpy.ndarray] = []
+
+    for start in range(0, len(encodings), FACE_CLUSTER_CHUNK_SIZE):
+        distances = face_distances(encodings, encodings[start:start + FACE_CLUSTER_CHUNK_SIZE])
+        neighbours.extend(numpy.flatnonzero(row <= eps) for row in distances)
+
+    labels = numpy.full(len(encodings), -1)
+    nr_clusters = 0
+
+    for i, own_neighbours in enumerate(neighbours):
+        if labels[i] != -1 or len(own_neighbours) < FACE_CLUSTER_MIN_SAMPLES:
+            continue
+
+        labels[i] = nr_clusters
+        queue = [i]
+
+        while queue:
+            j = queue.pop()
+            if len(neighbours[j]) < FACE_CLUSTER_MIN_SAMPLES:
+                continue
+
+            for k in neighbours[j]:
+                if labels[k] == -1:
+                    labels[k] = nr_clusters
+                    queue.append(k)
+
+        nr_clusters = nr_clusters + 1
+
+    clusters: list[list[int]] = [[] for _ in range(nr_clusters)]
+
+    for i, label in enumerate(labels):
+        if label == -1:
+            clusters.append([i])
+        else:
+            clusters[label].append(i)
+
+    return clusters
+
+@typechecked
+def ask_name_for_face(image_path: str, location: Union[tuple, list], crop_hash: Optional[str], nr_images: int, progress: Any) -> str:
+    print_file_title("Face-Detection", image_path)
+
+    # The cached crop saves decoding the whole (possibly huge) image again
+    if crop_hash is None or not display_face_crop(crop_hash):
+        display_sixel_part(image_path, location)
+
+    ask_string = "What is this person's name? [Just press enter if no person is visible or you don't want the person to be saved] "
+
+    if nr_images > 1:
+        ask_string = f"This face was found in {nr_images} images. {ask_string}"
+
+    try:
+        if progress:
+            with PauseProgress(progress):
+                return input(ask_string)
+
+        return input(ask_string)
+    except EOFError:
+        console.print("[red]You pressed CTRL+d[/]")
+        sys.exit(0)
+
+def run_face_recognition(conn: sqlite3.Connection, image_paths: list[str], progress: Any, task: Any) -> None:
+    # First find and store the faces of all images without asking anything, then
+    # label the ones nobody is known for. Only the faces of this run, older unknown
+    # faces are left to --label_faces.
+    for image_path, extracted in extract_faces_in_parallel(image_paths, progress, task):
+        store_extracted_faces(conn, image_path, *extracted)
+        maybe_flush_writes(conn)
+
+    if write_batcher is not None:
+        write_batcher.flush()
+
+    label_unknown_faces(conn, progress, image_paths)
+
+def run_face_detection_benchmark() -> None:
+    import PIL.Image
+
+    directory = args.dir or DEFAULT_DIR
+
+    nr_images = 0
+    nr_faces = 0
+    total_megapixels = 0.0
+    total_seconds = 0.0
+
+    console.print(f"[green]Timing face detection with --face_model {args.face_model} --face_upsample {args.face_upsample} --face_detection_max_size {args.face_detection_max_size}[/]")
+
+    for root, _, files in os.walk(directory):
+        for file in files:
+            image_path = os.path.join(root, file)
+
+            if Path(file).suffix.lower() not in supported_image_formats or is_ignored_path(image_path):
+                continue
+
+            try:
+                with DecodedImage(image_path) as frame:
+                    image = frame.rgb
+
+                    # Only the detection is timed, not decoding the image
+                    start_time = time.perf_counter()
+                    face_locations = detect_face_locations(image)
+                    seconds = time.perf_counter() - start_time
+            except (PIL.UnidentifiedImageError, PIL.Image.DecompressionBombError, OSError) as e:
+                console.print(f"[red]Could not load {image_path}: {e}[/]")
+                continue
+
+            megapixels = image.shape[0] * image.shape[1] / 1000000
+
+            console.print(f"{image_path}: {len(face_locations)} face(s), {megapixels:.1f} MP, {seconds:.2f}s, {seconds / megapixels:.3f}s/MP")
+
+            nr_images = nr_images + 1
+            nr_faces = nr_faces + len(face_locations)
+            total_megapixels = total_megapixels + megapixels
+            total_seconds = total_seconds + seconds
+
+    if nr_images == 0:
+        console.print(f"[yellow]No images found in {directory}[/]")
+        return
+
+    table = Table()
+    table.add_column("Metric", style="cyan")
+    table.add_column("Value", style="green")
+
+    table.add_row("Images", str(nr_images))
+    table.add_row("Faces found", str(nr_faces))
+    table.add_row("Megapixels", f"{total_megapixels:.1f}")
+    table.add_row("Detection time", f"{total_seconds:.2f}s")
+    table.add_row("Time per megapixel", f"{total_seconds / total_megapixels:.3f}s")
+
+    console.print(Panel.fit(table, title="Face detection benchmark", title_align="left"))
+
+@typechecked
+def load_yolo_analyzer() -> None:
+    with console.status("[bold green]Loading yolov5..."):
+        import yolov5
+
+@typechecked
+def load_ocr_analyzer() -> None:
+    global reader
+
+    with console.status("[bold green]Loading easyocr..."):
+        import easyocr
+
+    with console.status("[bold green]Loading reader..."):
+        try:
+            reader = easyocr.Reader(args.lang_ocr)
+        except ValueError as e:
+            console.print(f"[red]Loading OCR failed. This is probably an error with the --lang_ocr option. Error:[/] {e}")
+
+@typechecked
+def load_qrcodes_analyzer() -> None:
+    with console.status("[bold green]Loading pyzbar..."):
+        import pyzbar.pyzbar
+
+@typechecked
+def load_face_recognition_analyzer() -> None:
+    with console.status("[bold green]Loading face_recognition..."):
+        import face_recognition
+
+@typechecked
+def load_describe_analyzer() -> None:
+    with console.status("[bold green]Loading Blip-Models..."):
+        try:
+            load_blip_models()
+        except OSError as e:
+            console.print(f"[red]Loading the blip models failed with this error:[/] {e}")
+
+# Loaders of the modules and models every image stage needs. Only the stages that the
+# found images still miss are loaded, once before indexing starts, so worker processes
+# inherit them.
+ANALYZER_LOADERS: dict[str, Callable[[], None]] = {
+    "describe": load_describe_analyzer,
+    "yolo": load_yolo_analyzer,
+    "ocr": load_ocr_analyzer,
+    "qrcodes": load_qrcodes_analyzer,
+    "face_recognition": load_face_recognition_analyzer
+}
+
+@typechecked
+def load_analyzers(stages: list[str]) -> None:
+    try:
+        for stage in stages:
+            ANALYZER_LOADERS[stage]()
+    except ModuleNotFoundError as e:
+        console.print(f"[red]Module not found:[/] {e}")
+        sys.exit(1)
+
+    add_step_time("load analyzers")
+
+def run_index(conn: sqlite3.Connection, existing_files: Optional[dict]) -> None:
+    global indexed_stages
+
+    import requests
+    from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn, TimeRemainingColumn
+
+    model = None
+
+    load_file_fingerprints(conn)
+
+    image_paths = []
+    changed_image_paths = []
+
+    with console.status(f"[bold green]Finding images in {args.dir}..."):
+        indexed_stages = load_indexed_stages(conn)
+
+        for image_path, changed in find_images(indexed_stages, existing_files):
+            image_paths.append(image_path)
+
+            if changed:
+                changed_image_paths.append(image_path)
+
+    for image_path in changed_image_paths:
+        console.print(f"[yellow]{image_path} has changed since it was indexed. Indexing it again.[/]")
+        delete_entries_by_filename(conn, image_path)
+        forget_indexed_file(image_path)
+
+    save_file_fingerprints(conn)
+
+    if changed_image_paths and write_batcher is not None:
+        # The deletions have to be written before anything new for those files is inserted
+        write_batcher.flush()
+
+    # Only after the changed images were found, it hashes every file and so refreshes their fingerprints
+    if args.documents or do_all:
+        traverse_document_files(conn, args.dir)
+
+    # Only the stages that a found image still misses are loaded, so a run with nothing to do loads no model at all
+    pending_stages = get_pending_image_stages(image_paths)
+
+    add_step_time("find images")
+
+    load_analyzers(pending_stages)
+
+    if "yolo" in pending_stages:
+        try:
+            import yolov5
+            model = yolov5.load(args.yolo_model)
+            model.conf = args.yolo_min_confidence_for_saving
+        except (FileNotFoundError, requests.exceptions.ConnectionError) as e:
+            console.print(f"[red]!!! Error while loading yolov5 model[/red]: {e}")
+
+    if args.shuffle_index:
+        random.shuffle(image_paths)
+
+    face_recognition_images: list = []
+
+    with Progress(transient=True) as progress:
+        task = progress.add_task("Finding all images to be face-recognized...", total=None)
+
+        if args.face_recognition or do_all:
+            for image_path in image_paths:
+                if not faces_already_recognized(conn, image_path):
+                    face_recognition_images.append(image_path)
+                else:
+                    console.print(f"[green]The image {image_path} was already in the index")
+
+    run_face_or_image_index = args.describe or args.yolo or args.ocr or args.qrcodes or args.face_recognition
+
+    if run_face_or_image_index or do_all:
+        with Progress(
+            TextColumn("[bold blue]{task.description}"),
+            BarColumn(),
+            "[progress.percentage]{task.percentage:>3.0f}%",
+            "[bold green]{task.completed}/{task.total} images",
+            TimeElapsedColumn(),
+            "[bold]Remaining[/]",
+            TimeRemainingColumn(),
+            console=console,
+            transient=True
+        ) as progress:
+            total_images: int = len(image_paths) + len(face_recognition_images)
+            task = progress.add_task("Indexing images...", total=total_images)
+
+            if face_recognition_images:
+                run_face_recognition(conn, face_recognition_images, progress, task)
+
+            if args.jobs > 1:
+                index_images_in_parallel(conn, image_paths, existing_files, model, progress, task)
+            else:
+                start_digest_prefetch(image_paths)
+
+                for image_batch in chunk_list(image_paths, get_index_batch_size()):
+                    index_image_batch(conn, image_batch, existing_files, model)
+
+                    for image_path in image_batch:
+                        add_file_type(conn, image_path)
+
+                    maybe_flush_writes(conn)
+                    progress.update(task, advance=len(image_batch))
+
+def run_index_with_write_batching(conn: sqlite3.Connection, existing_files: Optional[dict]) -> None:
+    global write_batcher
+
+    write_batcher = WriteBatcher(conn, args.commit_every, args.commit_interval)
+
+    try:
+        run_index(conn, existing_files)
+
+        save_file_fingerprints(conn)
+        write_batcher.flush()
+
+        # Only once the rows of the persons in it are committed
+        compact_face_gallery()
+    except BaseException:
+        # Images whose rows were not committed yet will simply be indexed again next time
+        write_batcher.discard()
+        raise
+    finally:
+        stop_digest_prefetch()
+        write_batcher = None
+
+def maybe_flush_writes(conn: sqlite3.Connection) -> None:
+    save_file_fingerprints(conn)
+
+    if write_batcher is not None:
+        write_batcher.maybe_flush()
+
+@typechecked
+def print_timings() -> None:
+    table = Table(title="Timing")
+    table.add_column("Step", justify="left", style="cyan")
+    table.add_column("Time", justify="right", style="green")
+
+    for name, seconds in sorted(import_times.items(), key=lambda item: item[1], reverse=True):
+        table.add_row(f"import {name}", f"{seconds * 1000:.1f} ms")
+
+    for step, seconds in step_times:
+        table.add_row(step, f"{seconds * 1000:.1f} ms", style="bold" if step == "imports" else None)
+
+    table.add_row("Total", f"{(time.perf_counter() - startup_time) * 1000:.1f} ms", style="bold")
+
+    console.print(table)
 
 def main() -> None:
     dbg(f"Arguments: {args}")
@@ -2392,6 +4760,8 @@ def main() -> None:
 
     conn = init_database(args.dbfile)
 
+    add_step_time("open database")
+
     existing_files = None
 
     if args.run_hourly:
@@ -2412,92 +4782,48 @@ def main() -> None:
     if args.person_delete:
         delete_person(conn, args.person_delete)
 
-    if args.index:
+    if args.benchmark_face_detection:
         shown_something = True
 
-        model = None
-
-        if args.documents or do_all:
-            traverse_document_files(conn, args.dir)
-
-        if args.yolo or do_all:
-            try:
-                import yolov5
-                model = yolov5.load(args.yolo_model)
-                model.conf = args.yolo_min_confidence_for_saving
-            except (FileNotFoundError, requests.exceptions.ConnectionError) as e:
-                console.print(f"[red]!!! Error while loading yolov5 model[/red]: {e}")
-
-        image_paths = []
+        run_face_detection_benchmark()
 
-        with console.status(f"[bold green]Finding images in {args.dir}..."):
-            if existing_files is not None:
-                image_paths = list(find_images(existing_files))
-
-        if args.shuffle_index:
-            random.shuffle(image_paths)
+    if args.label_faces:
+        shown_something = True
 
-        face_recognition_images: list = []
+        label_unknown_faces(conn)
+        compact_face_gallery()
 
-        with Progress(transient=True) as progress:
-            task = progress.add_task("Finding all images to be face-recognized...", total=None)
+    if args.index:
+        shown_something = True
 
-            if args.face_recognition or do_all:
-                if supports_sixel():
+        run_index_with_write_batching(conn, existing_files)
 
-                    for image_path in image_paths:
-                        if not faces_already_recognized(conn, image_path):
-                            face_recognition_images.append(image_path)
-                        else:
-                            console.print(f"[green]The image {image_path} was already in the index")
-                else:
-                    console.print("[red]Cannot use --face_recognition without a terminal that supports sixel. You could not label images without it.")
-
-        run_face_or_image_index = args.describe or args.yolo or args.ocr or args.qrcodes or args.face_recognition
-
-        if run_face_or_image_index or do_all:
-            with Progress(
-                TextColumn("[bold blue]{task.description}"),
-                BarColumn(),
-                "[progress.percentage]{task.percentage:>3.0f}%",
-                "[bold green]{task.completed}/{task.total} images",
-                TimeElapsedColumn(),
-                "[bold]Remaining[/]",
-                TimeRemainingColumn(),
-                console=console,
-                transient=True
-            ) as progress:
-                total_images: int = len(image_paths) + len(face_recognition_images)
-                task = progress.add_task("Indexing images...", total=total_images)
-
-                for image_path in face_recognition_images:
-                    run_face_recognition_on_single_image(conn, image_path, progress)
-                    progress.update(task, advance=1)
-
-                for image_path in image_paths:
-                    index_image_file(conn, image_path, existing_files, model)
-                    add_file_type(conn, image_path)
-                    progress.update(task, advance=1)
+        add_step_time("index")
 
     if args.search:
         shown_something = True
 
         search_or_show_file(conn)
 
+        add_step_time("search")
+
     if not shown_something:
         show_statistics(conn)
 
     conn.close()
 
+    if args.timing:
+        print_timings()
+
 @typechecked
 def delete_person(conn: sqlite3.Connection, name: str) -> None:
     dbg(f"delete_person(conn, {name})")
-    known_encodings = load_encodings(args.encoding_face_recognition_file)
-    if name in known_encodings:
+    gallery = get_face_gallery()
+    if name in gallery.encodings:
         console.print(f"[yellow]Deleting {name} from {args.encoding_face_recognition_file}")
         if ask_confirmation():
-            del known_encodings[name]
-            save_encodings(known_encodings, args.encoding_face_recognition_file)
+            gallery.delete(name)
+            gallery.compact()
         else:
             console.print(f"[yellow]{name} found in {args.encoding_face_recognition_file}, but deletion was cancelled.[/]")
     else:
@@ -2505,6 +4831,8 @@ def delete_person(conn: sqlite3.Connection, name: str) -> None:
 
     console.print(f"[yellow]Deleting {name} from {args.dbfile}")
     if ask_confirmation():
+        # Their faces are unknown again, like ON DELETE SET NULL would do with foreign keys enabled
+        execute_with_retry(conn, 'UPDATE faces SET person_id = NULL WHERE person_id IN (SELECT id FROM person WHERE name = ?)', (name,))
         delete_from_table(conn, None, "person", name, "name")
     else:
         console.print(f"[yellow]Not deleting {name} from database")